@@ -0,0 +1,73 @@
+import os
+import re
+import sys
+import time
+import random
+import tempfile
+
+MESSAGES = int(sys.argv[1]) if len(sys.argv) > 1 else 200_000
+
+os.chdir(tempfile.mkdtemp(prefix="bench_antilink_"))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import bot
+
+WORDS = ("gg", "lol", "anyone up for a match", "brb", "that was insane", "who's online", "good morning everyone",
+         "can someone help me with the ticket", "nah", "thanks!", "see you tomorrow", "what time is the event",
+         "i think the update broke something", "same", "haha", "ok", "<:pepe:123456789012345678>", "😂😂", "@here")
+LINKS = ("https://youtube.com/watch?v=dQw4w9WgXcQ", "https://tenor.com/view/cat-123", "www.google.com",
+         "discord.gg/abcdef", "https://cdn.discordapp.com/attachments/1/2/image.png", "http://sketchy.example.ru/free-nitro")
+PUNCTUATED = ("ok. see you later", "wait... what", "v1.2 is out", "3.5/5 would play again", "and/or", "e.g. this one")
+
+# the single alternation the anti-link check used before LinkFilter
+ANTILINK_PATTERNS = [
+    r"https?://\S+",
+    r"\bwww\.\S+",
+    r"\bdiscord\.gg/\S+",
+    r"\bdiscordapp\.com/invite/\S+",
+]
+antiregex = re.compile("|".join(ANTILINK_PATTERNS), re.IGNORECASE)
+
+def make_corpus(n: int):
+    rnd = random.Random(42)
+    corpus = []
+    for _ in range(n):
+        roll = rnd.random()
+        text = " ".join(rnd.choice(WORDS) for _ in range(rnd.randint(1, 8)))
+        if roll < 0.03:
+            text += " " + rnd.choice(LINKS)
+        elif roll < 0.15:
+            text += " " + rnd.choice(PUNCTUATED)
+        corpus.append((rnd.randrange(10 ** 17, 10 ** 18), text))
+    return corpus
+
+def run_before(corpus, whitelist):
+    hits = 0
+    started = time.perf_counter()
+    for uid, content in corpus:
+        if str(uid) in whitelist:
+            continue
+        if antiregex.search(content or ""):
+            hits += 1
+    return hits, time.perf_counter() - started
+
+def run_after(corpus, guild_id):
+    hits = 0
+    check = bot.link_filter.check
+    whitelist = bot.link_filter.whitelist
+    started = time.perf_counter()
+    for uid, content in corpus:
+        if check(guild_id, content or "") and uid not in whitelist:
+            hits += 1
+    return hits, time.perf_counter() - started
+
+if __name__ == "__main__":
+    corpus = make_corpus(MESSAGES)
+    whitelist = [str(random.randrange(10 ** 17, 10 ** 18)) for _ in range(500)]
+    bot.antilink_cfg["whitelist"] = whitelist
+    bot.antilink_cfg["domains"]["1"] = {"allow": ["tenor.com", "discordapp.com"], "block": ["example.ru"]}
+    bot.link_filter.load(bot.antilink_cfg)
+    before_hits, before = run_before(corpus, whitelist)
+    after_hits, after = run_after(corpus, 1)
+    print(f"{MESSAGES} messages, {len(whitelist)} whitelisted users")
+    print(f"before: {MESSAGES / before:12,.0f} msg/s  ({before_hits} flagged)")
+    print(f"after:  {MESSAGES / after:12,.0f} msg/s  ({after_hits} flagged, tenor/discordapp allowlisted)")
@@ -0,0 +1,74 @@
+import os
+import sys
+import time
+import random
+import tempfile
+import tracemalloc
+
+USERS = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+
+os.chdir(tempfile.mkdtemp(prefix="bench_levels_"))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from bot import LevelTable, cumulative_msgs_for_level
+
+def make_ids(n: int):
+    rnd = random.Random(1234)
+    base = 100000000000000000
+    return [base + rnd.randrange(10 ** 18) for _ in range(n)]
+
+def build_dict_layout(ids):
+    users = {}
+    for i, uid in enumerate(ids):
+        users[str(uid)] = {"msgs": i % 5000, "level": (i % 5000) // 500}
+    return {"users": users}
+
+def build_table_layout(ids):
+    table = LevelTable()
+    for i, uid in enumerate(ids):
+        slot = table.slot(uid)
+        table.msgs[slot] = i % 5000
+        table.levels[slot] = (i % 5000) // 500
+    return table
+
+def measure(label: str, build, ids):
+    tracemalloc.start()
+    started = time.perf_counter()
+    data = build(ids)
+    elapsed = time.perf_counter() - started
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{label:<14} {current / 1024 / 1024:9.1f} MiB  {current / len(ids):7.1f} B/user  build {elapsed:6.2f} s")
+    return data
+
+def bump_dict(db, ids):
+    started = time.perf_counter()
+    for uid in ids:
+        user = db["users"].get(str(uid))
+        user["msgs"] = int(user.get("msgs", 0))
+        user["level"] = int(user.get("level", 0))
+        user["msgs"] += 1
+        while user["msgs"] >= cumulative_msgs_for_level(user["level"] + 1):
+            user["level"] += 1
+    return time.perf_counter() - started
+
+def bump_table(table, ids):
+    started = time.perf_counter()
+    for uid in ids:
+        slot = table.slot(uid)
+        msgs = table.msgs[slot] + 1
+        table.msgs[slot] = msgs
+        level = table.levels[slot]
+        while msgs >= cumulative_msgs_for_level(level + 1):
+            level += 1
+        table.levels[slot] = level
+    return time.perf_counter() - started
+
+if __name__ == "__main__":
+    ids = make_ids(USERS)
+    print(f"{USERS} users")
+    db = measure("dict layout", build_dict_layout, ids)
+    table = measure("LevelTable", build_table_layout, ids)
+    sample = ids[: min(len(ids), 200_000)]
+    d = bump_dict(db, sample)
+    t = bump_table(table, sample)
+    print(f"per-message update: dict {d / len(sample) * 1e9:.0f} ns  LevelTable {t / len(sample) * 1e9:.0f} ns")
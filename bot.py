@@ -4,7 +4,18 @@ import json
 import math
 import random
 import asyncio
-from datetime import datetime, timedelta
+import base64
+import gzip
+import bisect
+import heapq
+import shlex
+import sqlite3
+import sys
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from array import array
+from collections import Counter, OrderedDict
 from typing import Optional
 
 from dotenv import load_dotenv
@@ -38,23 +49,61 @@ open_tickets = {}
 ticket_cooldown = {}
 afk_users = {}
 giveaways = {}
-gw_records = {}
 
 LEVELS_FILE = "levels.json"
+LEVELS_DIR = os.getenv("LEVELS_DIR", "levels")
+LEVELS_MAX_PARTITIONS = int(os.getenv("LEVELS_MAX_PARTITIONS", "64"))
+LEVELS_COMPACT_EVERY = int(os.getenv("LEVELS_COMPACT_EVERY", "20000"))
 WARN_FILE = "warns.json"
 ANTILINK_FILE = "antilink.json"
+CONFIG_FILE = "config.json"
+AFK_FILE = "afk.json"
+GIVEAWAYS_FILE = "giveaways.json"
+GIVEAWAY_RECORDS_DIR = "giveaway_records"
+TICKETS_FILE = "tickets.json"
+POLLS_FILE = "polls.json"
+TRANSCRIPT_DIR = os.getenv("TRANSCRIPT_DIR", "transcripts")
+TRANSCRIPT_LOG_CHANNEL = int(os.getenv("TRANSCRIPT_LOG_CHANNEL", "0") or 0)
+TRANSCRIPT_PAGE_SIZE = max(1, min(100, int(os.getenv("TRANSCRIPT_PAGE_SIZE", "100"))))
+WARNINGS_PAGE_SIZE = int(os.getenv("WARNINGS_PAGE_SIZE", "5"))
+
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "json").lower()
+SQLITE_FILE = os.getenv("SQLITE_FILE", "bot.db")
+
+LEVELS_WRITE_MODE = os.getenv("LEVELS_WRITE_MODE", "behind").lower()
+LEVELS_FLUSH_INTERVAL = float(os.getenv("LEVELS_FLUSH_INTERVAL", "15"))
+LEVELS_FLUSH_THRESHOLD = int(os.getenv("LEVELS_FLUSH_THRESHOLD", "500"))
+
+AFK_NOTICE_COOLDOWN = float(os.getenv("AFK_NOTICE_COOLDOWN", "60"))
+AFK_MAX_AGE_HOURS = float(os.getenv("AFK_MAX_AGE_HOURS", "0"))
+
+GIVEAWAY_REFRESH_SECONDS = max(1, int(os.getenv("GIVEAWAY_REFRESH_SECONDS", "60")))
+GIVEAWAY_EDIT_DEBOUNCE = float(os.getenv("GIVEAWAY_EDIT_DEBOUNCE", "5"))
+GIVEAWAY_LEVEL_BONUS = float(os.getenv("GIVEAWAY_LEVEL_BONUS", "0"))
+GIVEAWAY_RECORDS_CACHE = int(os.getenv("GIVEAWAY_RECORDS_CACHE", "32"))
+GIVEAWAY_RECORDS_TTL_HOURS = float(os.getenv("GIVEAWAY_RECORDS_TTL_HOURS", "24"))
+
+POLL_EDIT_DEBOUNCE = float(os.getenv("POLL_EDIT_DEBOUNCE", "5"))
+
+PURGE_MAX_SCAN = int(os.getenv("PURGE_MAX_SCAN", "20000"))
+PURGE_OLD_DELAY = float(os.getenv("PURGE_OLD_DELAY", "1"))
+PURGE_PROGRESS_THRESHOLD = 500
+
+UNBAN_CONCURRENCY = max(1, int(os.getenv("UNBAN_CONCURRENCY", "3")))
+GIVEAWAY_ROLE_MULTIPLIERS = {
+    int(role_id): float(mult)
+    for role_id, _, mult in (item.strip().partition(":") for item in os.getenv("GIVEAWAY_ROLE_MULTIPLIERS", "").split(","))
+    if role_id.isdigit() and mult and float(mult) >= 0
+}
 
 def _levels_default():
     return {"users": {}}
 
-def load_levels():
-    if not os.path.exists(LEVELS_FILE):
-        with open(LEVELS_FILE, "w") as f:
-            json.dump(_levels_default(), f, indent=4)
-    try:
-        with open(LEVELS_FILE, "r") as f:
-            data = json.load(f)
-    except Exception:
+def _antilink_default():
+    return {"enabled": False, "whitelist": [], "domains": {}}
+
+def _normalize_levels(data):
+    if not isinstance(data, dict):
         data = _levels_default()
     if "users" not in data or not isinstance(data["users"], dict):
         data["users"] = {}
@@ -63,9 +112,928 @@ def load_levels():
             data["users"][uid] = {"msgs": 0, "level": int(u.get("level", 0))}
     return data
 
-def save_levels():
-    with open(LEVELS_FILE, "w") as f:
-        json.dump(levels_db, f, indent=4)
+def _normalize_antilink(data):
+    if not isinstance(data, dict):
+        data = _antilink_default()
+    if "enabled" not in data:
+        data["enabled"] = False
+    if "whitelist" not in data or not isinstance(data["whitelist"], list):
+        data["whitelist"] = []
+    if "domains" not in data or not isinstance(data["domains"], dict):
+        data["domains"] = {}
+    return data
+
+def _write_text(path: str, payload: str):
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        f.write(payload)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+def _read_json(path: str, default):
+    if not os.path.exists(path):
+        return default
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except Exception:
+        return default
+
+def _pack_array(values: array) -> bytes:
+    if sys.byteorder == "big":
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+def _unpack_array(typecode: str, raw: bytes) -> array:
+    values = array(typecode)
+    values.frombytes(raw)
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values
+
+def _replay_entries(path: str, after_seq: int, apply):
+    last = after_seq
+    count = 0
+    valid = 0
+    if not os.path.exists(path):
+        return last, count
+    with open(path, "rb") as f:
+        for raw in f:
+            if not raw.endswith(b"\n"):
+                break
+            try:
+                entry = json.loads(raw)
+                seq = int(entry[0])
+            except (ValueError, TypeError, IndexError):
+                break
+            valid += len(raw)
+            if seq <= after_seq:
+                continue
+            apply(entry[1:])
+            last = max(last, seq)
+            count += 1
+    if valid < os.path.getsize(path):
+        with open(path, "r+b") as f:
+            f.truncate(valid)
+    return last, count
+
+def _replay_journal(users, path: str, after_seq: int):
+    def apply(entry):
+        op = entry[0]
+        if op == "0":
+            for user in users.values():
+                user["msgs"] = 0
+                user["level"] = 0
+            return
+        user = users.setdefault(str(entry[1]), {"msgs": 0, "level": 0})
+        if op == "+":
+            user["msgs"] = int(user.get("msgs", 0)) + int(entry[2])
+        else:
+            user["msgs"] = int(entry[2])
+        user["level"] = int(entry[3])
+
+    return _replay_entries(path, after_seq, apply)
+
+class Journal:
+    def __init__(self, path: str, seq: int, entries: int):
+        self.path = path
+        self.seq = seq
+        self.entries = entries
+        self.fh = open(path, "ab")
+
+    def append(self, entry: list):
+        self.seq += 1
+        self.entries += 1
+        self.fh.write((json.dumps([self.seq] + entry, separators=(",", ":")) + "\n").encode())
+
+    def sync(self):
+        self.fh.flush()
+        os.fsync(self.fh.fileno())
+
+    def rotate(self) -> str:
+        retired = self.path + ".1"
+        self.fh.close()
+        if os.path.exists(retired):
+            # a previous compaction never landed: fold the live entries into
+            # the pending file so the next snapshot retires both at once
+            with open(self.path, "rb") as src, open(retired, "ab") as dst:
+                dst.write(src.read())
+                dst.flush()
+                os.fsync(dst.fileno())
+            self.fh = open(self.path, "wb")
+        else:
+            os.replace(self.path, retired)
+            self.fh = open(self.path, "ab")
+        self.entries = 0
+        return retired
+
+    def truncate(self):
+        self.fh.close()
+        self.fh = open(self.path, "wb")
+        self.entries = 0
+
+    def close(self):
+        self.fh.flush()
+        self.fh.close()
+
+class JsonStorage:
+    name = "json"
+
+    def __init__(self):
+        self._journals = {}
+        self._gw_journal = None
+        self._poll_journal = None
+        self._finish_legacy_seeds()
+
+    def _levels_path(self, guild_id: int) -> str:
+        return os.path.join(LEVELS_DIR, f"{int(guild_id)}.json")
+
+    def _read_levels(self, guild_id: int):
+        path = self._levels_path(guild_id)
+        journal_path = path[:-5] + ".journal"
+        data = _normalize_levels(_read_json(path, _levels_default()))
+        seq = int(data.pop("seq", 0))
+        seq, _ = _replay_journal(data["users"], journal_path + ".1", seq)
+        seq, entries = _replay_journal(data["users"], journal_path, seq)
+        return path, journal_path, data, seq, entries
+
+    def read_levels(self, guild_id: int):
+        # like load_levels, but opens no journal; safe off the event loop
+        _, _, data, seq, _ = self._read_levels(guild_id)
+        data["seq"] = seq
+        return data
+
+    def load_levels(self, guild_id: int):
+        os.makedirs(LEVELS_DIR, exist_ok=True)
+        path, journal_path, data, seq, entries = self._read_levels(guild_id)
+        if os.path.exists(journal_path + ".1"):
+            _write_text(path, json.dumps({"seq": seq, "users": data["users"]}))
+            os.remove(journal_path + ".1")
+            open(journal_path, "wb").close()
+            entries = 0
+        old = self._journals.pop(guild_id, None)
+        if old:
+            old.close()
+        self._journals[guild_id] = Journal(journal_path, seq, entries)
+        return data
+
+    def log_levels(self, guild_id: int, entry: list):
+        journal = self._journals.get(guild_id)
+        if journal:
+            journal.append(entry)
+
+    def release_levels(self, guild_id: int):
+        journal = self._journals.pop(guild_id, None)
+        if journal:
+            journal.close()
+
+    def snapshot_levels(self, guild_id: int, table, dirty=None):
+        journal = self._journals.get(guild_id)
+        if journal and dirty is not None and journal.entries < LEVELS_COMPACT_EVERY:
+            return journal, None, None, 0, None, len(dirty)
+        seq = journal.seq if journal else 0
+        retired = journal.rotate() if journal else None
+        return journal, self._levels_path(guild_id), table.copy(), seq, retired, len(table)
+
+    def write_levels(self, snapshot):
+        journal, path, table, seq, retired, rows = snapshot
+        if journal:
+            journal.sync()
+        if path is None:
+            return rows, 0
+        users = {str(uid): {"msgs": msgs, "level": level} for uid, msgs, level in table.rows()}
+        payload = json.dumps({"seq": seq, "users": users})
+        _write_text(path, payload)
+        if retired and os.path.exists(retired):
+            os.remove(retired)
+        return rows, len(payload)
+
+    def load_legacy_levels(self):
+        if not os.path.exists(LEVELS_FILE):
+            return None
+        return _normalize_levels(_read_json(LEVELS_FILE, _levels_default()))
+
+    def stage_levels(self, guild_id: int, table, seq: int = 0):
+        journal = self._journals.get(guild_id)
+        users = {str(uid): {"msgs": msgs, "level": level} for uid, msgs, level in table.rows()}
+        seed = self._levels_path(guild_id) + ".seed"
+        os.makedirs(LEVELS_DIR, exist_ok=True)
+        _write_text(seed, json.dumps({"seq": journal.seq if journal else seq, "users": users}))
+        return seed
+
+    def commit_legacy_levels(self, staged):
+        # renaming levels.json is the commit point; seeds left behind by a
+        # crash after it are moved into place by _finish_legacy_seeds
+        self.retire_legacy_levels()
+        for seed in staged:
+            os.replace(seed, seed[:-5])
+
+    def _finish_legacy_seeds(self):
+        if not os.path.isdir(LEVELS_DIR):
+            return
+        committed = not os.path.exists(LEVELS_FILE)
+        for name in os.listdir(LEVELS_DIR):
+            if name.endswith(".json.seed"):
+                seed = os.path.join(LEVELS_DIR, name)
+                if committed:
+                    os.replace(seed, seed[:-5])
+                else:
+                    os.remove(seed)
+
+    def retire_legacy_levels(self):
+        if os.path.exists(LEVELS_FILE):
+            os.replace(LEVELS_FILE, LEVELS_FILE + ".migrated")
+
+    def load_warns(self):
+        if not os.path.exists(WARN_FILE):
+            with open(WARN_FILE, "w") as f:
+                json.dump({}, f)
+        with open(WARN_FILE, "r") as f:
+            return json.load(f)
+
+    def save_warns(self, db):
+        _write_text(WARN_FILE, json.dumps(db, indent=4))
+
+    def add_warn(self, db, uid: str, entry: dict):
+        self.save_warns(db)
+
+    def remove_warn(self, db, uid: str, warn_id: str):
+        self.save_warns(db)
+
+    def load_antilink(self):
+        if not os.path.exists(ANTILINK_FILE):
+            with open(ANTILINK_FILE, "w") as f:
+                json.dump(_antilink_default(), f, indent=4)
+        return _normalize_antilink(_read_json(ANTILINK_FILE, _antilink_default()))
+
+    def save_antilink(self, cfg):
+        _write_text(ANTILINK_FILE, json.dumps(cfg, indent=4))
+
+    def load_afk(self):
+        data = _read_json(AFK_FILE, {})
+        return data if isinstance(data, dict) else {}
+
+    def save_afk(self, db):
+        _write_text(AFK_FILE, json.dumps(db, indent=4))
+
+    def set_afk(self, db, uid: str, entry: dict):
+        self.save_afk(db)
+
+    def clear_afk(self, db, uids):
+        self.save_afk(db)
+
+    def load_giveaways(self):
+        data = _read_json(GIVEAWAYS_FILE, {})
+        seq = int(data.get("seq", 0))
+        gws = {}
+        for mid, g in data.get("giveaways", {}).items():
+            g["participants"] = set(int(uid) for uid in g.get("participants", []))
+            gws[int(mid)] = g
+        journal_path = GIVEAWAYS_FILE[:-5] + ".journal"
+
+        def apply(entry):
+            message_id, uid, joined = entry
+            data = gws.get(int(message_id))
+            if data is not None:
+                if joined:
+                    data["participants"].add(int(uid))
+                else:
+                    data["participants"].discard(int(uid))
+
+        seq, entries = _replay_entries(journal_path, seq, apply)
+        if self._gw_journal:
+            self._gw_journal.close()
+        self._gw_journal = Journal(journal_path, seq, entries)
+        return gws
+
+    def save_giveaways(self, gws):
+        if self._gw_journal is None:
+            self.load_giveaways()
+        journal = self._gw_journal
+        payload = {
+            "seq": journal.seq,
+            "giveaways": {str(mid): dict(g, participants=sorted(g["participants"])) for mid, g in gws.items()},
+        }
+        _write_text(GIVEAWAYS_FILE, json.dumps(payload))
+        journal.truncate()
+
+    def save_giveaway(self, gws, message_id: int):
+        self.save_giveaways(gws)
+
+    def remove_giveaway(self, gws, message_id: int):
+        self.save_giveaways(gws)
+
+    def log_giveaway_entry(self, message_id: int, uid: int, joined: bool):
+        if self._gw_journal is None:
+            self.load_giveaways()
+        self._gw_journal.append([int(message_id), int(uid), 1 if joined else 0])
+        self._gw_journal.fh.flush()
+
+    def load_polls(self):
+        data = _read_json(POLLS_FILE, {})
+        seq = int(data.get("seq", 0))
+        polls = {}
+        for pid, p in data.get("polls", {}).items():
+            p["votes"] = {int(uid): int(idx) for uid, idx in p.get("votes", {}).items()}
+            polls[int(pid)] = p
+        journal_path = POLLS_FILE[:-5] + ".journal"
+
+        def apply(entry):
+            poll_id, uid, idx = entry
+            poll = polls.get(int(poll_id))
+            if poll is not None:
+                poll["votes"][int(uid)] = int(idx)
+
+        seq, entries = _replay_entries(journal_path, seq, apply)
+        if self._poll_journal:
+            self._poll_journal.close()
+        self._poll_journal = Journal(journal_path, seq, entries)
+        return polls
+
+    def save_polls(self, polls):
+        if self._poll_journal is None:
+            self.load_polls()
+        journal = self._poll_journal
+        payload = {
+            "seq": journal.seq,
+            "polls": {
+                str(pid): {
+                    "message_id": p.get("message_id"), "channel_id": p["channel_id"], "author_id": p.get("author_id"),
+                    "question": p["question"], "options": p["options"], "end": p.get("end"),
+                    "votes": {str(uid): idx for uid, idx in p["votes"].items()},
+                }
+                for pid, p in polls.items()
+            },
+        }
+        _write_text(POLLS_FILE, json.dumps(payload))
+        journal.truncate()
+
+    def save_poll(self, polls, poll_id: int):
+        self.save_polls(polls)
+
+    def remove_poll(self, polls, poll_id: int):
+        self.save_polls(polls)
+
+    def log_poll_vote(self, poll_id: int, uid: int, idx: int):
+        if self._poll_journal is None:
+            self.load_polls()
+        self._poll_journal.append([int(poll_id), int(uid), int(idx)])
+        self._poll_journal.fh.flush()
+
+    def load_tickets(self):
+        data = _read_json(TICKETS_FILE, {})
+        return {int(cid): entry for cid, entry in data.items()} if isinstance(data, dict) else {}
+
+    def save_tickets(self, db):
+        _write_text(TICKETS_FILE, json.dumps({str(cid): entry for cid, entry in db.items()}, indent=4))
+
+    def save_ticket(self, db, channel_id: int):
+        self.save_tickets(db)
+
+    def remove_tickets(self, db, channel_ids):
+        self.save_tickets(db)
+
+    def save_giveaway_record(self, message_id: int, record: dict):
+        os.makedirs(GIVEAWAY_RECORDS_DIR, exist_ok=True)
+        payload = dict(record)
+        for key in ("entrants", "weights"):
+            if payload.get(key) is not None:
+                payload[key] = base64.b64encode(payload[key]).decode()
+        _write_text(os.path.join(GIVEAWAY_RECORDS_DIR, f"{int(message_id)}.json"), json.dumps(payload))
+
+    def load_giveaway_record(self, message_id: int):
+        record = _read_json(os.path.join(GIVEAWAY_RECORDS_DIR, f"{int(message_id)}.json"), None)
+        if not isinstance(record, dict):
+            return None
+        for key in ("entrants", "weights"):
+            if record.get(key) is not None:
+                record[key] = base64.b64decode(record[key])
+        return record
+
+    def get_config(self, key: str, default=None):
+        return _read_json(CONFIG_FILE, {}).get(key, default)
+
+    def set_config(self, key: str, value):
+        cfg = _read_json(CONFIG_FILE, {})
+        cfg[key] = value
+        _write_text(CONFIG_FILE, json.dumps(cfg, indent=4))
+
+    def close(self):
+        for guild_id in list(self._journals):
+            self.release_levels(guild_id)
+        if self._gw_journal:
+            self._gw_journal.close()
+            self._gw_journal = None
+        if self._poll_journal:
+            self._poll_journal.close()
+            self._poll_journal = None
+
+class SqliteStorage:
+    name = "sqlite"
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(
+            "CREATE TABLE IF NOT EXISTS levels ("
+            " user_id INTEGER PRIMARY KEY, msgs INTEGER NOT NULL DEFAULT 0, level INTEGER NOT NULL DEFAULT 0);"
+            "CREATE TABLE IF NOT EXISTS guild_levels ("
+            " guild_id INTEGER NOT NULL, user_id INTEGER NOT NULL, msgs INTEGER NOT NULL DEFAULT 0,"
+            " level INTEGER NOT NULL DEFAULT 0, PRIMARY KEY (guild_id, user_id)) WITHOUT ROWID;"
+            "CREATE TABLE IF NOT EXISTS warns ("
+            " row_id INTEGER PRIMARY KEY AUTOINCREMENT, warn_id TEXT NOT NULL, user_id INTEGER NOT NULL,"
+            " moderator TEXT, reason TEXT, date TEXT);"
+            "CREATE INDEX IF NOT EXISTS warns_by_id ON warns(warn_id);"
+            "CREATE INDEX IF NOT EXISTS warns_by_user ON warns(user_id);"
+            "CREATE TABLE IF NOT EXISTS config (key TEXT PRIMARY KEY, value TEXT NOT NULL);"
+            "CREATE TABLE IF NOT EXISTS afk (user_id INTEGER PRIMARY KEY, reason TEXT, since TEXT NOT NULL);"
+            "CREATE TABLE IF NOT EXISTS giveaways ("
+            " message_id INTEGER PRIMARY KEY, channel_id INTEGER NOT NULL, prize TEXT, winners INTEGER NOT NULL,"
+            " started REAL, end_at REAL NOT NULL);"
+            "CREATE TABLE IF NOT EXISTS giveaway_entries ("
+            " message_id INTEGER NOT NULL, user_id INTEGER NOT NULL, PRIMARY KEY (message_id, user_id)) WITHOUT ROWID;"
+            "CREATE TABLE IF NOT EXISTS giveaway_records ("
+            " message_id INTEGER PRIMARY KEY, channel_id INTEGER NOT NULL, prize TEXT, won TEXT NOT NULL,"
+            " entrants BLOB NOT NULL, weights BLOB);"
+            "CREATE TABLE IF NOT EXISTS polls ("
+            " poll_id INTEGER PRIMARY KEY, message_id INTEGER, channel_id INTEGER NOT NULL, author_id INTEGER,"
+            " question TEXT, options TEXT NOT NULL, end_at REAL);"
+            "CREATE TABLE IF NOT EXISTS poll_votes ("
+            " poll_id INTEGER NOT NULL, user_id INTEGER NOT NULL, option INTEGER NOT NULL, PRIMARY KEY (poll_id, user_id)) WITHOUT ROWID;"
+            "CREATE TABLE IF NOT EXISTS tickets ("
+            " channel_id INTEGER PRIMARY KEY, guild_id INTEGER NOT NULL, creator_id INTEGER NOT NULL,"
+            " category TEXT, claimed_by INTEGER);"
+        )
+        self._migrate_json()
+
+    def _get_config(self, key: str, default=None):
+        row = self.conn.execute("SELECT value FROM config WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def _set_config(self, key: str, value):
+        self.conn.execute(
+            "INSERT INTO config (key, value) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+            (key, json.dumps(value)),
+        )
+
+    def _migrate_json(self):
+        with self._lock:
+            if self._get_config("migrated_from_json"):
+                return
+            levels = _normalize_levels(_read_json(LEVELS_FILE, _levels_default()))
+            warns = _read_json(WARN_FILE, {})
+            antilink = _read_json(ANTILINK_FILE, None)
+            self.conn.execute("BEGIN")
+            try:
+                self.conn.executemany(
+                    "INSERT OR REPLACE INTO levels (user_id, msgs, level) VALUES (?, ?, ?)",
+                    ((int(uid), int(u.get("msgs", 0)), int(u.get("level", 0)))
+                     for uid, u in levels["users"].items() if str(uid).isdigit()),
+                )
+                self.conn.executemany(
+                    "INSERT INTO warns (warn_id, user_id, moderator, reason, date) VALUES (?, ?, ?, ?, ?)",
+                    ((str(w.get("id")), int(uid), w.get("moderator"), w.get("reason", ""), w.get("date", ""))
+                     for uid, lst in (warns.items() if isinstance(warns, dict) else []) if str(uid).isdigit()
+                     for w in lst),
+                )
+                if antilink is not None:
+                    self._set_config("antilink", _normalize_antilink(antilink))
+                self._set_config("migrated_from_json", datetime.utcnow().isoformat())
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+
+    def load_levels(self, guild_id: int):
+        with self._lock:
+            rows = self.conn.execute("SELECT user_id, msgs, level FROM guild_levels WHERE guild_id = ?", (int(guild_id),)).fetchall()
+        return {"users": {str(uid): {"msgs": msgs, "level": level} for uid, msgs, level in rows}}
+
+    def read_levels(self, guild_id: int):
+        return self.load_levels(guild_id)
+
+    def snapshot_levels(self, guild_id: int, table, dirty=None):
+        guild_id = int(guild_id)
+        return [(guild_id, uid, msgs, level) for uid, msgs, level in table.rows(dirty)]
+
+    def _upsert_levels(self, rows):
+        self.conn.executemany(
+            "INSERT INTO guild_levels (guild_id, user_id, msgs, level) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT(guild_id, user_id) DO UPDATE SET msgs = excluded.msgs, level = excluded.level",
+            rows,
+        )
+
+    def write_levels(self, snapshot):
+        with self._lock:
+            self.conn.execute("BEGIN")
+            try:
+                self._upsert_levels(snapshot)
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+        return len(snapshot), 0
+
+    def stage_levels(self, guild_id: int, table, seq: int = 0):
+        return self.snapshot_levels(guild_id, table)
+
+    def commit_legacy_levels(self, staged):
+        with self._lock:
+            self.conn.execute("BEGIN")
+            try:
+                for rows in staged:
+                    self._upsert_levels(rows)
+                self._set_config("levels_partitioned", datetime.utcnow().isoformat())
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+
+    def log_levels(self, guild_id: int, entry: list):
+        pass
+
+    def release_levels(self, guild_id: int):
+        pass
+
+    def load_legacy_levels(self):
+        with self._lock:
+            if self._get_config("levels_partitioned"):
+                return None
+            rows = self.conn.execute("SELECT user_id, msgs, level FROM levels").fetchall()
+        return {"users": {str(uid): {"msgs": msgs, "level": level} for uid, msgs, level in rows}}
+
+    def load_warns(self):
+        with self._lock:
+            rows = self.conn.execute("SELECT warn_id, user_id, moderator, reason, date FROM warns ORDER BY row_id").fetchall()
+        db = {}
+        for warn_id, uid, moderator, reason, date in rows:
+            db.setdefault(str(uid), []).append({"id": warn_id, "moderator": moderator, "reason": reason, "date": date})
+        return db
+
+    def save_warns(self, db):
+        with self._lock:
+            self.conn.execute("BEGIN")
+            try:
+                self.conn.execute("DELETE FROM warns")
+                self.conn.executemany(
+                    "INSERT INTO warns (warn_id, user_id, moderator, reason, date) VALUES (?, ?, ?, ?, ?)",
+                    ((w["id"], int(uid), w.get("moderator"), w.get("reason", ""), w.get("date", "")) for uid, lst in db.items() for w in lst),
+                )
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+
+    def add_warn(self, db, uid: str, entry: dict):
+        with self._lock:
+            self.conn.execute(
+                "INSERT INTO warns (warn_id, user_id, moderator, reason, date) VALUES (?, ?, ?, ?, ?)",
+                (entry["id"], int(uid), entry.get("moderator"), entry.get("reason", ""), entry.get("date", "")),
+            )
+
+    def remove_warn(self, db, uid: str, warn_id: str):
+        with self._lock:
+            self.conn.execute("DELETE FROM warns WHERE warn_id = ? AND user_id = ?", (warn_id, int(uid)))
+
+    def load_antilink(self):
+        with self._lock:
+            return _normalize_antilink(self._get_config("antilink", _antilink_default()))
+
+    def save_antilink(self, cfg):
+        with self._lock:
+            self._set_config("antilink", cfg)
+
+    def load_afk(self):
+        with self._lock:
+            rows = self.conn.execute("SELECT user_id, reason, since FROM afk").fetchall()
+        return {str(uid): {"reason": reason, "since": since} for uid, reason, since in rows}
+
+    def save_afk(self, db):
+        with self._lock:
+            self.conn.execute("BEGIN")
+            try:
+                self.conn.execute("DELETE FROM afk")
+                self.conn.executemany(
+                    "INSERT INTO afk (user_id, reason, since) VALUES (?, ?, ?)",
+                    ((int(uid), e.get("reason"), e["since"]) for uid, e in db.items()),
+                )
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+
+    def set_afk(self, db, uid: str, entry: dict):
+        with self._lock:
+            self.conn.execute(
+                "INSERT INTO afk (user_id, reason, since) VALUES (?, ?, ?) "
+                "ON CONFLICT(user_id) DO UPDATE SET reason = excluded.reason, since = excluded.since",
+                (int(uid), entry.get("reason"), entry["since"]),
+            )
+
+    def clear_afk(self, db, uids):
+        with self._lock:
+            self.conn.executemany("DELETE FROM afk WHERE user_id = ?", ((int(uid),) for uid in uids))
+
+    def load_giveaways(self):
+        with self._lock:
+            rows = self.conn.execute("SELECT message_id, channel_id, prize, winners, started, end_at FROM giveaways").fetchall()
+            entries = self.conn.execute("SELECT message_id, user_id FROM giveaway_entries").fetchall()
+        gws = {
+            mid: {"end": end_at, "prize": prize, "winners": winners, "participants": set(), "channel_id": channel_id, "started": started}
+            for mid, channel_id, prize, winners, started, end_at in rows
+        }
+        for mid, uid in entries:
+            if mid in gws:
+                gws[mid]["participants"].add(uid)
+        return gws
+
+    def save_giveaway(self, gws, message_id: int):
+        g = gws[message_id]
+        with self._lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO giveaways (message_id, channel_id, prize, winners, started, end_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (int(message_id), int(g["channel_id"]), g["prize"], int(g["winners"]), g.get("started"), g["end"]),
+            )
+
+    def remove_giveaway(self, gws, message_id: int):
+        with self._lock:
+            self.conn.execute("BEGIN")
+            try:
+                self.conn.execute("DELETE FROM giveaway_entries WHERE message_id = ?", (int(message_id),))
+                self.conn.execute("DELETE FROM giveaways WHERE message_id = ?", (int(message_id),))
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+
+    def log_giveaway_entry(self, message_id: int, uid: int, joined: bool):
+        with self._lock:
+            if joined:
+                self.conn.execute("INSERT OR IGNORE INTO giveaway_entries (message_id, user_id) VALUES (?, ?)", (int(message_id), int(uid)))
+            else:
+                self.conn.execute("DELETE FROM giveaway_entries WHERE message_id = ? AND user_id = ?", (int(message_id), int(uid)))
+
+    def load_polls(self):
+        with self._lock:
+            rows = self.conn.execute("SELECT poll_id, message_id, channel_id, author_id, question, options, end_at FROM polls").fetchall()
+            votes = self.conn.execute("SELECT poll_id, user_id, option FROM poll_votes").fetchall()
+        polls = {
+            pid: {"message_id": mid, "channel_id": cid, "author_id": author, "question": question,
+                  "options": json.loads(options), "end": end_at, "votes": {}}
+            for pid, mid, cid, author, question, options, end_at in rows
+        }
+        for pid, uid, idx in votes:
+            if pid in polls:
+                polls[pid]["votes"][uid] = idx
+        return polls
+
+    def save_poll(self, polls, poll_id: int):
+        p = polls[poll_id]
+        with self._lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO polls (poll_id, message_id, channel_id, author_id, question, options, end_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (int(poll_id), p.get("message_id"), int(p["channel_id"]), p.get("author_id"), p["question"], json.dumps(p["options"]), p.get("end")),
+            )
+
+    def remove_poll(self, polls, poll_id: int):
+        with self._lock:
+            self.conn.execute("BEGIN")
+            try:
+                self.conn.execute("DELETE FROM poll_votes WHERE poll_id = ?", (int(poll_id),))
+                self.conn.execute("DELETE FROM polls WHERE poll_id = ?", (int(poll_id),))
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+
+    def log_poll_vote(self, poll_id: int, uid: int, idx: int):
+        with self._lock:
+            self.conn.execute(
+                "INSERT INTO poll_votes (poll_id, user_id, option) VALUES (?, ?, ?) "
+                "ON CONFLICT(poll_id, user_id) DO UPDATE SET option = excluded.option",
+                (int(poll_id), int(uid), int(idx)),
+            )
+
+    def load_tickets(self):
+        with self._lock:
+            rows = self.conn.execute("SELECT channel_id, guild_id, creator_id, category, claimed_by FROM tickets").fetchall()
+        return {
+            cid: {"guild_id": gid, "creator_id": creator, "category": category, "claimed_by": claimed_by}
+            for cid, gid, creator, category, claimed_by in rows
+        }
+
+    def save_ticket(self, db, channel_id: int):
+        t = db[channel_id]
+        with self._lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO tickets (channel_id, guild_id, creator_id, category, claimed_by) VALUES (?, ?, ?, ?, ?)",
+                (int(channel_id), int(t["guild_id"]), int(t["creator_id"]), t.get("category"), t.get("claimed_by")),
+            )
+
+    def remove_tickets(self, db, channel_ids):
+        with self._lock:
+            self.conn.executemany("DELETE FROM tickets WHERE channel_id = ?", ((int(cid),) for cid in channel_ids))
+
+    def save_giveaway_record(self, message_id: int, record: dict):
+        with self._lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO giveaway_records (message_id, channel_id, prize, won, entrants, weights) VALUES (?, ?, ?, ?, ?, ?)",
+                (int(message_id), int(record["channel_id"]), record["prize"], json.dumps(record["won"]), record["entrants"], record.get("weights")),
+            )
+
+    def load_giveaway_record(self, message_id: int):
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT channel_id, prize, won, entrants, weights FROM giveaway_records WHERE message_id = ?", (int(message_id),)
+            ).fetchone()
+        if not row:
+            return None
+        channel_id, prize, won, entrants, weights = row
+        return {"channel_id": channel_id, "prize": prize, "won": json.loads(won), "entrants": entrants, "weights": weights}
+
+    def get_config(self, key: str, default=None):
+        with self._lock:
+            return self._get_config(key, default)
+
+    def set_config(self, key: str, value):
+        with self._lock:
+            self._set_config(key, value)
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
+
+def open_storage():
+    if STORAGE_BACKEND == "sqlite":
+        return SqliteStorage(SQLITE_FILE)
+    return JsonStorage()
+
+storage = open_storage()
+
+def save_levels(guild_id: int, dirty=None):
+    part = level_partitions.resident(guild_id)
+    if part is not None:
+        storage.write_levels(storage.snapshot_levels(guild_id, part.users, dirty))
+
+class LevelsWriter:
+    def __init__(self, interval: float, threshold: int):
+        self.interval = max(1.0, interval)
+        self.threshold = max(1, threshold)
+        self.dirty = {}
+        self.dirty_count = 0
+        self.flushing = set()
+        self.flushes = 0
+        self.errors = 0
+        self.last_ms = 0.0
+        self.max_ms = 0.0
+        self.total_ms = 0.0
+        self.last_rows = 0
+        self.last_bytes = 0
+        self.total_bytes = 0
+        self._wake = None
+        self._lock = None
+        self._task = None
+
+    @property
+    def pending(self) -> int:
+        total = 0
+        for guild_id, uids in self.dirty.items():
+            if uids is None:
+                part = level_partitions.resident(guild_id)
+                total += len(part.users) if part else 0
+            else:
+                total += len(uids)
+        return total
+
+    def is_dirty(self, guild_id: int) -> bool:
+        # a guild whose write is still in the executor counts as dirty so it
+        # is not evicted (and its journal closed) underneath the worker
+        return guild_id in self.dirty or guild_id in self.flushing
+
+    def mark_dirty(self, guild_id: int, uid=None):
+        if uid is None:
+            self.dirty[guild_id] = None
+            self.request_flush()
+            return
+        uids = self.dirty.setdefault(guild_id, set())
+        if uids is not None and uid not in uids:
+            uids.add(uid)
+            self.dirty_count += 1
+        if self.dirty_count >= self.threshold:
+            self.request_flush()
+
+    def request_flush(self):
+        if self._wake:
+            self._wake.set()
+
+    def _take(self):
+        dirty = self.dirty
+        self.dirty = {}
+        self.dirty_count = 0
+        return dirty
+
+    def _restore(self, dirty):
+        for guild_id, uids in dirty.items():
+            current = self.dirty.get(guild_id, set())
+            if uids is None or current is None:
+                self.dirty[guild_id] = None
+            else:
+                self.dirty[guild_id] = current | uids
+                self.dirty_count += len(uids)
+
+    def _snapshots(self, dirty):
+        snapshots = []
+        for guild_id, uids in dirty.items():
+            part = level_partitions.resident(guild_id)
+            if part is not None:
+                snapshots.append(storage.snapshot_levels(guild_id, part.users, uids))
+        return snapshots
+
+    @staticmethod
+    def _write(snapshots):
+        rows = size = 0
+        for snapshot in snapshots:
+            r, b = storage.write_levels(snapshot)
+            rows += r
+            size += b
+        return rows, size
+
+    def _record(self, started: float, rows: int, size: int):
+        elapsed = (time.perf_counter() - started) * 1000
+        self.flushes += 1
+        self.last_ms = elapsed
+        self.max_ms = max(self.max_ms, elapsed)
+        self.total_ms += elapsed
+        self.last_rows = rows
+        self.last_bytes = size
+        self.total_bytes += size
+
+    async def flush(self):
+        if not self.dirty:
+            return
+        async with self._lock:
+            dirty = self._take()
+            self.flushing = set(dirty)
+            started = time.perf_counter()
+            try:
+                snapshots = self._snapshots(dirty)
+                rows, size = await asyncio.get_running_loop().run_in_executor(None, self._write, snapshots)
+            except Exception:
+                self.errors += 1
+                self._restore(dirty)
+                raise
+            finally:
+                self.flushing = set()
+            self._record(started, rows, size)
+        level_partitions.evict()
+
+    def flush_sync(self):
+        if not self.dirty:
+            return
+        dirty = self._take()
+        started = time.perf_counter()
+        rows, size = self._write(self._snapshots(dirty))
+        self._record(started, rows, size)
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._wake = asyncio.Event()
+            self._lock = asyncio.Lock()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self):
+        while not bot.is_closed():
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                await self.flush()
+            except Exception:
+                pass
+
+    def summary(self) -> str:
+        avg = self.total_ms / self.flushes if self.flushes else 0.0
+        size = f"{self.last_rows} rows" + (f" / {self.last_bytes / 1024:.1f} KiB" if self.last_bytes else "")
+        return (f"{self.flushes} flushes • last {self.last_ms:.1f} ms • avg {avg:.1f} ms • max {self.max_ms:.1f} ms\n"
+                f"last {size} • pending {self.pending} • errors {self.errors} • {storage.name}\n"
+                f"{level_partitions.summary()}")
+
+levels_writer = LevelsWriter(LEVELS_FLUSH_INTERVAL, LEVELS_FLUSH_THRESHOLD)
+
+def levels_changed(guild_id: int, uid=None, entry=None):
+    if entry is not None:
+        storage.log_levels(guild_id, entry)
+    if LEVELS_WRITE_MODE == "sync":
+        save_levels(guild_id, None if uid is None else [uid])
+    else:
+        levels_writer.mark_dirty(guild_id, uid)
 
 def cumulative_msgs_for_level(level: int) -> int:
     return 25 * level * (level + 1)
@@ -73,41 +1041,418 @@ def cumulative_msgs_for_level(level: int) -> int:
 def msgs_needed_for_next(level: int) -> int:
     return 50 * (level + 1)
 
-def get_user_stats(uid: int):
-    uid = str(uid)
-    user = levels_db["users"].get(uid)
-    if not user:
-        user = {"msgs": 0, "level": 0}
-        levels_db["users"][uid] = user
-    user["msgs"] = int(user.get("msgs", 0))
-    user["level"] = int(user.get("level", 0))
-    return user
+class _RankNode:
+    __slots__ = ("key", "next", "width")
 
-def add_message_and_check_levelup(uid: int):
-    user = get_user_stats(uid)
-    user["msgs"] += 1
-    leveled_up = 0
-    while user["msgs"] >= cumulative_msgs_for_level(user["level"] + 1):
-        user["level"] += 1
-        leveled_up += 1
-    save_levels()
-    cur_level = user["level"]
-    cur_prog = user["msgs"] - cumulative_msgs_for_level(cur_level)
+    def __init__(self, key, height: int):
+        self.key = key
+        self.next = [None] * height
+        self.width = [1] * height
+
+class LeaderboardIndex:
+    MAX_HEIGHT = 24
+
+    def __init__(self):
+        self._reset()
+
+    def _reset(self):
+        self._tail = _RankNode((math.inf, 0), 0)
+        self._head = _RankNode(None, self.MAX_HEIGHT)
+        self._head.next = [self._tail] * self.MAX_HEIGHT
+        self.keys = {}
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    @staticmethod
+    def _key(uid: int, msgs: int):
+        return (-msgs, uid)
+
+    def _height(self) -> int:
+        height = 1
+        while height < self.MAX_HEIGHT and random.random() < 0.5:
+            height += 1
+        return height
+
+    def _insert(self, key):
+        chain = [None] * self.MAX_HEIGHT
+        steps = [0] * self.MAX_HEIGHT
+        node = self._head
+        for lvl in reversed(range(self.MAX_HEIGHT)):
+            while node.next[lvl].key < key:
+                steps[lvl] += node.width[lvl]
+                node = node.next[lvl]
+            chain[lvl] = node
+        height = self._height()
+        new = _RankNode(key, height)
+        travelled = 0
+        for lvl in range(height):
+            prev = chain[lvl]
+            new.next[lvl] = prev.next[lvl]
+            prev.next[lvl] = new
+            new.width[lvl] = prev.width[lvl] - travelled
+            prev.width[lvl] = travelled + 1
+            travelled += steps[lvl]
+        for lvl in range(height, self.MAX_HEIGHT):
+            chain[lvl].width[lvl] += 1
+
+    def _remove(self, key):
+        chain = [None] * self.MAX_HEIGHT
+        node = self._head
+        for lvl in reversed(range(self.MAX_HEIGHT)):
+            while node.next[lvl].key < key:
+                node = node.next[lvl]
+            chain[lvl] = node
+        target = chain[0].next[0]
+        if target.key != key:
+            return
+        height = len(target.next)
+        for lvl in range(height):
+            prev = chain[lvl]
+            prev.width[lvl] += target.width[lvl] - 1
+            prev.next[lvl] = target.next[lvl]
+        for lvl in range(height, self.MAX_HEIGHT):
+            chain[lvl].width[lvl] -= 1
+
+    def update(self, uid: int, msgs: int):
+        uid = int(uid)
+        new_key = self._key(uid, msgs)
+        old_key = self.keys.get(uid)
+        if old_key == new_key:
+            return
+        if old_key is not None:
+            self._remove(old_key)
+        self._insert(new_key)
+        self.keys[uid] = new_key
+
+    def discard(self, uid: int):
+        old_key = self.keys.pop(int(uid), None)
+        if old_key is not None:
+            self._remove(old_key)
+
+    def rank(self, uid: int) -> Optional[int]:
+        key = self.keys.get(int(uid))
+        if key is None:
+            return None
+        node = self._head
+        pos = 0
+        for lvl in reversed(range(self.MAX_HEIGHT)):
+            while node.next[lvl].key <= key:
+                pos += node.width[lvl]
+                node = node.next[lvl]
+        return pos
+
+    def iter_from(self, start: int = 0):
+        if start >= len(self.keys):
+            return
+        node = self._head
+        pos = start + 1
+        for lvl in reversed(range(self.MAX_HEIGHT)):
+            while node.width[lvl] <= pos:
+                pos -= node.width[lvl]
+                node = node.next[lvl]
+        while node is not self._tail:
+            yield node.key[1], -node.key[0]
+            node = node.next[0]
+
+    def rebuild(self, entries):
+        self._reset()
+        for uid, msgs in entries:
+            self.update(uid, msgs)
+
+class LevelRow:
+    __slots__ = ("_table", "_slot")
+
+    def __init__(self, table, slot: int):
+        self._table = table
+        self._slot = slot
+
+    def __getitem__(self, key: str) -> int:
+        if key == "msgs":
+            return self._table.msgs[self._slot]
+        if key == "level":
+            return self._table.levels[self._slot]
+        raise KeyError(key)
+
+    def __setitem__(self, key: str, value: int):
+        if key == "msgs":
+            self._table.msgs[self._slot] = value
+        elif key == "level":
+            self._table.levels[self._slot] = value
+        else:
+            raise KeyError(key)
+
+    def get(self, key: str, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def keys(self):
+        return ("msgs", "level")
+
+    def __iter__(self):
+        return iter(self.keys())
+
+class LevelTable:
+    def __init__(self):
+        self._slots = {}
+        self._free = []
+        self.msgs = array("q")
+        self.levels = array("l")
+
+    @classmethod
+    def from_users(cls, users):
+        table = cls()
+        for uid, user in users.items():
+            if not str(uid).isdigit():
+                continue
+            slot = table.slot(int(uid))
+            table.msgs[slot] = int(user.get("msgs", 0))
+            table.levels[slot] = int(user.get("level", 0))
+        return table
+
+    def find(self, uid) -> Optional[int]:
+        return self._slots.get(int(uid))
+
+    def slot(self, uid) -> int:
+        uid = int(uid)
+        slot = self._slots.get(uid)
+        if slot is None:
+            if self._free:
+                slot = self._free.pop()
+                self.msgs[slot] = 0
+                self.levels[slot] = 0
+            else:
+                slot = len(self.msgs)
+                self.msgs.append(0)
+                self.levels.append(0)
+            self._slots[uid] = slot
+        return slot
+
+    def rows(self, uids=None):
+        msgs, levels = self.msgs, self.levels
+        if uids is None:
+            for uid, slot in self._slots.items():
+                yield uid, msgs[slot], levels[slot]
+            return
+        for uid in uids:
+            slot = self._slots.get(int(uid))
+            if slot is not None:
+                yield int(uid), msgs[slot], levels[slot]
+
+    def copy(self):
+        # dict and array copies are C-level memcpys; cheap enough for the loop
+        table = LevelTable()
+        table._slots = self._slots.copy()
+        table.msgs = array("q", self.msgs)
+        table.levels = array("l", self.levels)
+        return table
+
+    def reset(self):
+        self.msgs = array("q", bytes(self.msgs.itemsize * len(self.msgs)))
+        self.levels = array("l", bytes(self.levels.itemsize * len(self.levels)))
+
+    def nbytes(self) -> int:
+        return (sys.getsizeof(self._slots) + sys.getsizeof(self._free)
+                + self.msgs.itemsize * len(self.msgs) + self.levels.itemsize * len(self.levels))
+
+    def __len__(self) -> int:
+        return len(self._slots)
+
+    def __contains__(self, uid) -> bool:
+        return str(uid).isdigit() and int(uid) in self._slots
+
+    def __iter__(self):
+        return (str(uid) for uid in self._slots)
+
+    def __getitem__(self, uid) -> LevelRow:
+        slot = self._slots.get(int(uid))
+        if slot is None:
+            raise KeyError(uid)
+        return LevelRow(self, slot)
+
+    def __setitem__(self, uid, user):
+        slot = self.slot(uid)
+        self.msgs[slot] = int(user.get("msgs", 0))
+        self.levels[slot] = int(user.get("level", 0))
+
+    def __delitem__(self, uid):
+        slot = self._slots.pop(int(uid))
+        self._free.append(slot)
+
+    def get(self, uid, default=None):
+        slot = self._slots.get(int(uid))
+        return default if slot is None else LevelRow(self, slot)
+
+    def keys(self):
+        return iter(self)
+
+    def values(self):
+        return (LevelRow(self, slot) for slot in self._slots.values())
+
+    def items(self):
+        return ((str(uid), LevelRow(self, slot)) for uid, slot in self._slots.items())
+
+def is_ranked_member(guild, uid: int) -> bool:
+    member = guild.get_member(uid)
+    return member is not None and not member.bot
+
+class GuildLevels:
+    def __init__(self, guild_id: int, data):
+        self.guild_id = guild_id
+        self.users = LevelTable.from_users(data["users"])
+        self.leaderboard = LeaderboardIndex()
+        self.rebuild_leaderboard()
+
+    def rebuild_leaderboard(self):
+        # only current non-bot members are ranked, so !rank and !top read
+        # positions straight off the index; departures are discarded as they
+        # happen in on_member_remove
+        rows = ((uid, msgs) for uid, msgs, _ in self.users.rows())
+        guild = bot.get_guild(self.guild_id)
+        if guild is not None and guild.chunked:
+            rows = ((uid, msgs) for uid, msgs in rows if is_ranked_member(guild, uid))
+        self.leaderboard.rebuild(rows)
+
+    def stats(self, uid: int) -> LevelRow:
+        if self.users.find(uid) is None:
+            self.leaderboard.update(uid, 0)
+        return LevelRow(self.users, self.users.slot(uid))
+
+class LevelPartitions:
+    def __init__(self, capacity: int):
+        self.capacity = max(1, capacity)
+        self._parts = OrderedDict()
+        self.loads = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._parts)
+
+    def resident(self, guild_id: int) -> Optional[GuildLevels]:
+        return self._parts.get(guild_id)
+
+    def get(self, guild_id: int) -> GuildLevels:
+        part = self._parts.get(guild_id)
+        if part is not None:
+            self._parts.move_to_end(guild_id)
+            return part
+        part = GuildLevels(guild_id, storage.load_levels(guild_id))
+        self._parts[guild_id] = part
+        self.loads += 1
+        self.evict()
+        return part
+
+    def evict(self):
+        if len(self._parts) <= self.capacity:
+            return
+        for guild_id in list(self._parts)[:-1]:
+            if len(self._parts) <= self.capacity:
+                break
+            if levels_writer.is_dirty(guild_id):
+                continue
+            del self._parts[guild_id]
+            storage.release_levels(guild_id)
+            self.evictions += 1
+        if len(self._parts) > self.capacity:
+            levels_writer.request_flush()
+
+    def summary(self) -> str:
+        size = sum(part.users.nbytes() for part in self._parts.values())
+        return (f"{len(self._parts)}/{self.capacity} guilds resident ({size / 1024:.1f} KiB) • "
+                f"{self.loads} loads • {self.evictions} evictions")
+
+level_partitions = LevelPartitions(LEVELS_MAX_PARTITIONS)
+
+def add_message_and_check_levelup(guild_id: int, uid: int):
+    part = level_partitions.get(guild_id)
+    table = part.users
+    slot = table.slot(uid)
+    msgs = table.msgs[slot] + 1
+    table.msgs[slot] = msgs
+    cur_level = start_level = table.levels[slot]
+    while msgs >= cumulative_msgs_for_level(cur_level + 1):
+        cur_level += 1
+    leveled_up = cur_level - start_level
+    if leveled_up:
+        table.levels[slot] = cur_level
+    part.leaderboard.update(uid, msgs)
+    levels_changed(guild_id, uid, ["+", uid, 1, cur_level])
+    cur_prog = msgs - cumulative_msgs_for_level(cur_level)
     next_req = msgs_needed_for_next(cur_level)
-    return leveled_up, cur_level, cur_prog, next_req, user["msgs"]
+    return leveled_up, cur_level, cur_prog, next_req, msgs
 
-def set_level(uid: int, level: int):
-    user = get_user_stats(uid)
+def set_level(guild_id: int, uid: int, level: int):
+    part = level_partitions.get(guild_id)
+    user = part.stats(uid)
     level = max(0, int(level))
     user["level"] = level
     user["msgs"] = cumulative_msgs_for_level(level)
-    save_levels()
+    part.leaderboard.update(uid, user["msgs"])
+    levels_changed(guild_id, uid, ["=", uid, user["msgs"], level])
+    levels_writer.request_flush()
+
+def set_all_zero(guild_id: int):
+    part = level_partitions.get(guild_id)
+    part.users.reset()
+    part.rebuild_leaderboard()
+    levels_changed(guild_id, None, ["0"])
 
-def set_all_zero():
-    for uid in list(levels_db["users"].keys()):
-        levels_db["users"][uid]["level"] = 0
-        levels_db["users"][uid]["msgs"] = 0
-    save_levels()
+def _merge_legacy_user(users, uid: str, legacy):
+    user = users.get(uid)
+    if user is None:
+        users[uid] = {"msgs": int(legacy.get("msgs", 0)), "level": int(legacy.get("level", 0))}
+        return users[uid]
+    user["msgs"] = int(user.get("msgs", 0)) + int(legacy.get("msgs", 0))
+    user["level"] = max(int(user.get("level", 0)), int(legacy.get("level", 0)))
+    while user["msgs"] >= cumulative_msgs_for_level(user["level"] + 1):
+        user["level"] += 1
+    return user
+
+def _stage_legacy_levels(members, resident):
+    legacy = storage.load_legacy_levels()
+    if legacy is None:
+        return None
+    users = legacy["users"]
+    plan = {}
+    staged = {}
+    for guild_id, uids in members:
+        seeds = {str(uid): users[str(uid)] for uid in uids if str(uid) in users}
+        if not seeds:
+            continue
+        plan[guild_id] = seeds
+        if guild_id not in resident:
+            data = storage.read_levels(guild_id)
+            for uid, user in seeds.items():
+                _merge_legacy_user(data["users"], uid, user)
+            staged[guild_id] = storage.stage_levels(guild_id, LevelTable.from_users(data["users"]), data.get("seq", 0))
+    return plan, staged
+
+async def migrate_legacy_levels(guilds):
+    # parse and stage every partition in the executor, then commit all of them
+    # in one step, so a crash part-way never adds the same legacy XP twice
+    members = [(g.id, [m.id for m in g.members if not m.bot]) for g in guilds]
+    resident = {guild_id for guild_id, _ in members if level_partitions.resident(guild_id) is not None}
+    result = await asyncio.get_running_loop().run_in_executor(None, _stage_legacy_levels, members, resident)
+    if result is None:
+        return 0
+    plan, staged = result
+    live = [guild_id for guild_id in plan if level_partitions.resident(guild_id) is not None]
+    for guild_id in live:
+        # loaded since staging (or resident all along): stage from a copy of
+        # the live table and only touch the partition once the commit landed
+        table = level_partitions.resident(guild_id).users.copy()
+        for uid, user in plan[guild_id].items():
+            _merge_legacy_user(table, uid, user)
+        staged[guild_id] = storage.stage_levels(guild_id, table)
+    storage.commit_legacy_levels(list(staged.values()))
+    for guild_id in live:
+        part = level_partitions.resident(guild_id)
+        for uid, user in plan[guild_id].items():
+            merged = _merge_legacy_user(part.users, uid, user)
+            part.leaderboard.update(int(uid), merged["msgs"])
+    return len(plan)
 
 def progress_bar(current: int, total: int, width: int = 20) -> str:
     if total <= 0:
@@ -116,63 +1461,288 @@ def progress_bar(current: int, total: int, width: int = 20) -> str:
     filled = int(round(width * ratio))
     return "▰" * filled + "▱" * (width - filled)
 
-levels_db = load_levels()
 
 def load_warns():
-    if not os.path.exists(WARN_FILE):
-        with open(WARN_FILE, "w") as f:
-            json.dump({}, f)
-    with open(WARN_FILE, "r") as f:
-        return json.load(f)
+    return storage.load_warns()
 
 def save_warns():
-    with open(WARN_FILE, "w") as f:
-        json.dump(warns_db, f, indent=4)
+    storage.save_warns(warns_db)
+
+class WarnIndex:
+    FIRST_ID = 100000
+
+    def __init__(self):
+        self.owner = {}
+        self.next_id = self.FIRST_ID
+
+    def build(self, db) -> bool:
+        self.owner = {}
+        self.next_id = max(self.FIRST_ID, int(storage.get_config("warn_next_id", self.FIRST_ID)))
+        duplicates = []
+        for uid, warn_list in db.items():
+            for w in warn_list:
+                warn_id = str(w.get("id"))
+                if warn_id in self.owner:
+                    duplicates.append(w)
+                    continue
+                self.owner[warn_id] = uid
+                if warn_id.isdigit():
+                    self.next_id = max(self.next_id, int(warn_id) + 1)
+        for w in duplicates:
+            w["id"] = self.new_id()
+        for uid, warn_list in db.items():
+            for w in warn_list:
+                self.owner[str(w["id"])] = uid
+        return bool(duplicates)
+
+    def new_id(self) -> str:
+        while str(self.next_id) in self.owner:
+            self.next_id += 1
+        warn_id = str(self.next_id)
+        self.next_id += 1
+        storage.set_config("warn_next_id", self.next_id)
+        return warn_id
+
+    def add(self, warn_id: str, uid: str):
+        self.owner[warn_id] = uid
+
+    def pop(self, warn_id: str) -> Optional[str]:
+        return self.owner.pop(warn_id, None)
+
+warn_index = WarnIndex()
 
 def generate_warn_id():
-    from random import randint
-    return str(randint(100000, 999999))
+    return warn_index.new_id()
 
 warns_db = load_warns()
-
-def _antilink_default():
-    return {"enabled": False, "whitelist": []}
+if warn_index.build(warns_db):
+    save_warns()
 
 def load_antilink():
-    if not os.path.exists(ANTILINK_FILE):
-        with open(ANTILINK_FILE, "w") as f:
-            json.dump(_antilink_default(), f, indent=4)
-    with open(ANTILINK_FILE, "r") as f:
-        try:
-            data = json.load(f)
-        except Exception:
-            data = _antilink_default()
-    if "enabled" not in data:
-        data["enabled"] = False
-    if "whitelist" not in data or not isinstance(data["whitelist"], list):
-        data["whitelist"] = []
-    return data
+    return storage.load_antilink()
 
 def save_antilink():
-    with open(ANTILINK_FILE, "w") as f:
-        json.dump(antilink_cfg, f, indent=4)
+    storage.save_antilink(antilink_cfg)
 
 antilink_cfg = load_antilink()
 
-ANTILINK_PATTERNS = [
-    r"https?://\S+",
-    r"\bwww\.\S+",
-    r"\bdiscord\.gg/\S+",
-    r"\bdiscordapp\.com/invite/\S+",
-]
-antiregex = re.compile("|".join(ANTILINK_PATTERNS), re.IGNORECASE)
+LINK_REGEX = re.compile(r"(https?://|\bwww\.)(\S+)|\b(discord\.gg)/\S|\b(discordapp\.com)/invite/\S", re.IGNORECASE)
+BARE_DOMAIN_REGEX = re.compile(r"\b((?:[a-z0-9-]+\.)+[a-z]{2,})\b", re.IGNORECASE)
+HOST_CHARS_REGEX = re.compile(r"[a-z0-9.-]*", re.IGNORECASE)
+
+def normalize_domain(value: str) -> str:
+    value = value.strip().lower()
+    if "://" in value:
+        value = value.split("://", 1)[1]
+    value = re.split(r"[/?#]", value, 1)[0].rsplit("@", 1)[-1].split(":", 1)[0]
+    if value.startswith("*."):
+        value = value[2:]
+    return value.strip(".")
+
+class DomainTrie:
+    def __init__(self):
+        self.root = {}
+        self.size = 0
+
+    def add(self, domain: str, verdict: str):
+        node = self.root
+        for label in reversed(domain.split(".")):
+            node = node.setdefault(label, {})
+        if "$" not in node:
+            self.size += 1
+        node["$"] = verdict
+
+    def lookup(self, host: str) -> Optional[str]:
+        node = self.root
+        verdict = None
+        for label in reversed(host.split(".")):
+            node = node.get(label)
+            if node is None:
+                break
+            verdict = node.get("$", verdict)
+        return verdict
+
+class LinkFilter:
+    def __init__(self):
+        self.whitelist = set()
+        self._tries = {}
+
+    def load(self, cfg):
+        self.whitelist = {int(uid) for uid in cfg.get("whitelist", []) if str(uid).isdigit()}
+        self._tries = {}
+
+    def invalidate(self, guild_id: int):
+        self._tries.pop(guild_id, None)
+
+    def _trie(self, guild_id: int) -> DomainTrie:
+        trie = self._tries.get(guild_id)
+        if trie is None:
+            trie = DomainTrie()
+            lists = antilink_cfg["domains"].get(str(guild_id), {})
+            for domain in lists.get("allow", []):
+                trie.add(domain, "allow")
+            for domain in lists.get("block", []):
+                trie.add(domain, "block")
+            self._tries[guild_id] = trie
+        return trie
+
+    @staticmethod
+    def _host(match) -> str:
+        if match.group(3) or match.group(4):
+            return (match.group(3) or match.group(4)).lower()
+        tail = re.split(r"[/?#]", match.group(2), 1)[0].rsplit("@", 1)[-1]
+        host = HOST_CHARS_REGEX.match(tail).group(0).lower().strip(".")
+        if not match.group(1).lower().startswith("http"):
+            host = "www." + host
+        return host
+
+    def check(self, guild_id: int, content: str) -> Optional[str]:
+        if "." not in content and "/" not in content:
+            return None
+        trie = self._trie(guild_id)
+        for match in LINK_REGEX.finditer(content):
+            host = self._host(match)
+            if not trie.size or trie.lookup(host) != "allow":
+                return host or match.group(0)
+        if trie.size:
+            for match in BARE_DOMAIN_REGEX.finditer(content):
+                host = match.group(1).lower()
+                if trie.lookup(host) == "block":
+                    return host
+        return None
+
+link_filter = LinkFilter()
+link_filter.load(antilink_cfg)
+
+class PermissionCache:
+    def __init__(self):
+        self._guilds = {}
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def is_mod(self, member: discord.Member) -> bool:
+        guild = getattr(member, "guild", None)
+        if guild is None:
+            return False
+        members = self._guilds.setdefault(guild.id, {})
+        decision = members.get(member.id)
+        if decision is not None:
+            self.hits += 1
+            return decision
+        self.misses += 1
+        perms = member.guild_permissions
+        decision = bool(perms.manage_messages or perms.administrator)
+        members[member.id] = decision
+        return decision
+
+    def forget_member(self, guild_id: int, member_id: int):
+        members = self._guilds.get(guild_id)
+        if members and members.pop(member_id, None) is not None:
+            self.invalidations += 1
+
+    def forget_guild(self, guild_id: int):
+        if self._guilds.pop(guild_id, None):
+            self.invalidations += 1
+
+    def summary(self) -> str:
+        total = self.hits + self.misses
+        rate = self.hits / total * 100 if total else 0.0
+        size = sum(len(m) for m in self._guilds.values())
+        return f"{rate:.1f}% hit rate • {self.hits} hits / {self.misses} misses • {size} cached • {self.invalidations} invalidations"
+
+perm_cache = PermissionCache()
 
 def antilink_allowed(member: discord.Member) -> bool:
-    if member.guild_permissions.manage_messages or member.guild_permissions.administrator:
+    if member.id in link_filter.whitelist:
         return True
-    if str(member.id) in antilink_cfg.get("whitelist", []):
+    return perm_cache.is_mod(member)
+
+class LatencyHistogram:
+    BOUNDS_MS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 1000)
+
+    def __init__(self):
+        self.buckets = [0] * (len(self.BOUNDS_MS) + 1)
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def observe(self, ms: float):
+        self.buckets[bisect.bisect_left(self.BOUNDS_MS, ms)] += 1
+        self.count += 1
+        self.total_ms += ms
+        self.max_ms = max(self.max_ms, ms)
+
+    def percentile(self, pct: float) -> float:
+        if not self.count:
+            return 0.0
+        target = self.count * pct / 100
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if seen >= target:
+                return self.BOUNDS_MS[i] if i < len(self.BOUNDS_MS) else self.max_ms
+        return self.max_ms
+
+    def summary(self) -> str:
+        avg = self.total_ms / self.count if self.count else 0.0
+        return f"n={self.count} avg {avg:.2f} ms • p50 ≤{self.percentile(50):g} • p99 ≤{self.percentile(99):g} • max {self.max_ms:.1f} ms"
+
+class InteractionRouter:
+    def __init__(self):
+        self.routes = {}
+        self.aliases = {}
+        self.counts = {}
+        self.errors = {}
+        self.timings = {}
+        self.unrouted = 0
+
+    def route(self, namespace: str):
+        def register(func):
+            self.routes[namespace] = func
+            self.counts[namespace] = 0
+            self.errors[namespace] = 0
+            self.timings[namespace] = LatencyHistogram()
+            return func
+        return register
+
+    def alias(self, custom_id: str, namespace: str, arg: str = ""):
+        self.aliases[custom_id] = (namespace, arg)
+
+    async def dispatch(self, interaction: discord.Interaction) -> bool:
+        if interaction.type is not discord.InteractionType.component or not interaction.data:
+            return False
+        custom_id = interaction.data.get("custom_id")
+        if not custom_id:
+            return False
+        target = self.aliases.get(custom_id)
+        if target is None:
+            namespace, sep, arg = custom_id.partition(":")
+            if not sep:
+                self.unrouted += 1
+                return False
+        else:
+            namespace, arg = target
+        handler = self.routes.get(namespace)
+        if handler is None:
+            self.unrouted += 1
+            return False
+        self.counts[namespace] += 1
+        started = time.perf_counter()
+        try:
+            await handler(interaction, arg)
+        except Exception as e:
+            self.errors[namespace] += 1
+            print(f"interaction route {namespace} failed for {custom_id!r}: {e!r}")
+        self.timings[namespace].observe((time.perf_counter() - started) * 1000)
         return True
-    return False
+
+    def summary(self) -> str:
+        lines = [f"{ns}: {self.counts[ns]} • {self.errors[ns]} errors • {self.timings[ns].summary()}" for ns in self.routes]
+        lines.append(f"left to views: {self.unrouted}")
+        return "\n".join(lines)
+
+interaction_router = InteractionRouter()
 
 def winners_label(n: int) -> str:
     return "1 winner" if n == 1 else f"{n} winners"
@@ -221,118 +1791,595 @@ def build_gw_description(prize: str, ends_in: str, participants: int, winners: i
         f"Press Join to participate."
     )
 
+def build_gw_embed(data: dict, remaining: int) -> discord.Embed:
+    embed = discord.Embed(
+        title=f"Giveaway running — {winners_label(data['winners'])}",
+        description=build_gw_description(data["prize"], fmt_delta(remaining), len(data["participants"]), data["winners"]),
+        color=COLOR_BASE, timestamp=datetime.utcfromtimestamp(data.get("started") or datetime.utcnow().timestamp())
+    )
+    if THUMB_URL:
+        embed.set_thumbnail(url=THUMB_URL)
+    return embed
+
 class GiveawayView(discord.ui.View):
     def __init__(self, msg_id: int):
         super().__init__(timeout=None)
         self.msg_id = msg_id
+        self.add_item(discord.ui.Button(label="Join 🎉", style=discord.ButtonStyle.success, custom_id=f"gw:{msg_id}"))
+
+@interaction_router.route("gw")
+async def _route_giveaway(interaction: discord.Interaction, arg: str):
+    msg_id = int(arg) if arg.isdigit() else interaction.message.id
+    data = giveaways.get(msg_id)
+    if not data:
+        return await interaction.response.send_message("This giveaway is no longer active.", ephemeral=True)
+    uid = interaction.user.id
+    if uid in data["participants"]:
+        data["participants"].remove(uid)
+        text = "You left the giveaway."
+    else:
+        data["participants"].add(uid)
+        text = "You joined the giveaway."
+    storage.log_giveaway_entry(msg_id, uid, uid in data["participants"])
+    await interaction.response.send_message(text, ephemeral=True)
+    gw_scheduler.touch(msg_id)
+
+interaction_router.alias("gw_join", "gw")
+
+class WinnerPool:
+    def __init__(self, entrants, weights=None):
+        self.entrants = array("q", entrants)
+        self.weights = None if weights is None else array("d", weights)
+
+    def __len__(self) -> int:
+        return len(self.entrants)
+
+    def _pick_weighted(self, k: int):
+        # weighted sampling without replacement over a Fenwick tree: each
+        # draw descends the tree in O(log n), then zeroes the winner's weight.
+        # Zero-weight entrants never enter the tree and can't be drawn.
+        n = len(self.weights)
+        left = [w if w > 0 else 0.0 for w in self.weights]
+        remaining = sum(1 for w in left if w)
+        k = min(k, remaining)
+        top = 1 << (n.bit_length() - 1)
+
+        def build():
+            tree = [0.0] + left
+            for i in range(1, n + 1):
+                parent = i + (i & -i)
+                if parent <= n:
+                    tree[parent] += tree[i]
+            return tree
 
-    @discord.ui.button(label="Join 🎉", style=discord.ButtonStyle.success, custom_id="gw_join")
-    async def join(self, interaction: discord.Interaction, _):
-        data = giveaways.get(self.msg_id)
-        if not data:
-            return await interaction.response.send_message("This giveaway is no longer active.", ephemeral=True)
-        uid = interaction.user.id
-        if uid in data["participants"]:
-            data["participants"].remove(uid)
-            text = "You left the giveaway."
+        tree = build()
+        picked = []
+        rebuilt = False
+        while len(picked) < k:
+            total = 0.0
+            i = n
+            while i:
+                total += tree[i]
+                i -= i & -i
+            r = random.random() * total
+            pos = 0
+            step = top
+            while step:
+                if pos + step <= n and tree[pos + step] <= r:
+                    pos += step
+                    r -= tree[pos]
+                step >>= 1
+            if pos >= n or not left[pos]:
+                # float drift from the subtractions: rebuild once from the
+                # exact weights, then settle on the nearest live entrant
+                if not rebuilt:
+                    tree = build()
+                    rebuilt = True
+                    continue
+                pos = min(pos, n - 1)
+                while pos >= 0 and not left[pos]:
+                    pos -= 1
+                if pos < 0:
+                    pos = next(i for i in range(n) if left[i])
+            rebuilt = False
+            weight, left[pos] = left[pos], 0.0
+            picked.append(pos)
+            i = pos + 1
+            while i <= n:
+                tree[i] -= weight
+                i += i & -i
+        return picked
+
+    def _remove(self, indices):
+        for i in sorted(indices, reverse=True):
+            last = len(self.entrants) - 1
+            self.entrants[i] = self.entrants[last]
+            self.entrants.pop()
+            if self.weights is not None:
+                self.weights[i] = self.weights[last]
+                self.weights.pop()
+
+    def draw(self, k: int):
+        k = min(k, len(self.entrants))
+        if k <= 0:
+            return []
+        if self.weights is None:
+            picked = random.sample(range(len(self.entrants)), k)
         else:
-            data["participants"].add(uid)
-            text = "You joined the giveaway."
-        try:
-            msg = interaction.message or await interaction.channel.fetch_message(self.msg_id)
-            if msg and msg.embeds:
-                embed = msg.embeds[0]
-                remaining = max(0, int(data["end"] - datetime.utcnow().timestamp()))
-                embed.title = f"Giveaway running — {winners_label(data['winners'])}"
-                embed.description = build_gw_description(data["prize"], fmt_delta(remaining), len(data["participants"]), data["winners"])
-                await msg.edit(embed=embed, view=self)
-        except Exception:
-            pass
-        await interaction.response.send_message(text, ephemeral=True)
+            picked = self._pick_weighted(k)
+        winners = [self.entrants[i] for i in picked]
+        self._remove(picked)
+        return winners
+
+class GiveawayRecords:
+    def __init__(self, capacity: int, ttl_hours: float):
+        self.capacity = max(1, capacity)
+        self.ttl = ttl_hours * 3600 if ttl_hours > 0 else None
+        self._records = OrderedDict()
+        self.loads = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _encode(rec: dict) -> dict:
+        pool = rec["pool"]
+        if pool.weights is None:
+            entrants, weights = array("q", sorted(pool.entrants)), None
+        else:
+            pairs = sorted(zip(pool.entrants, pool.weights))
+            entrants = array("q", (uid for uid, _ in pairs))
+            weights = _pack_array(array("d", (w for _, w in pairs)))
+        return {
+            "prize": rec["prize"],
+            "channel_id": rec["channel_id"],
+            "won": list(rec["won"]),
+            "entrants": _pack_array(entrants),
+            "weights": weights,
+        }
+
+    @staticmethod
+    def _decode(raw: dict) -> dict:
+        weights = raw.get("weights")
+        pool = WinnerPool(_unpack_array("q", raw["entrants"]), None if weights is None else _unpack_array("d", weights))
+        return {"prize": raw.get("prize", "Prize"), "pool": pool, "won": array("q", raw.get("won", [])), "channel_id": raw["channel_id"]}
+
+    def put(self, message_id: int, rec: dict):
+        self._records[message_id] = (rec, time.monotonic())
+        self._records.move_to_end(message_id)
+        self.save(message_id)
+        self._evict()
+
+    def save(self, message_id: int):
+        entry = self._records.get(message_id)
+        if entry:
+            storage.save_giveaway_record(message_id, self._encode(entry[0]))
+
+    def get(self, message_id: int):
+        entry = self._records.get(message_id)
+        if entry is not None:
+            self._records[message_id] = (entry[0], time.monotonic())
+            self._records.move_to_end(message_id)
+            return entry[0]
+        raw = storage.load_giveaway_record(message_id)
+        if raw is None:
+            return None
+        rec = self._decode(raw)
+        self.loads += 1
+        self._records[message_id] = (rec, time.monotonic())
+        self._evict()
+        return rec
+
+    def _evict(self):
+        now = time.monotonic()
+        while self._records:
+            message_id, (_, used) = next(iter(self._records.items()))
+            if len(self._records) <= self.capacity and (self.ttl is None or now - used < self.ttl):
+                break
+            del self._records[message_id]
+            self.evictions += 1
+
+    def summary(self) -> str:
+        entrants = sum(len(rec["pool"]) for rec, _ in self._records.values())
+        return f"{len(self._records)}/{self.capacity} ended in memory ({entrants} pooled entrants) • {self.loads} reloads • {self.evictions} evicted"
+
+gw_records = GiveawayRecords(GIVEAWAY_RECORDS_CACHE, GIVEAWAY_RECORDS_TTL_HOURS)
+
+def giveaway_weights(guild, entrants):
+    if guild is None or (GIVEAWAY_LEVEL_BONUS <= 0 and not GIVEAWAY_ROLE_MULTIPLIERS):
+        return None
+    table = level_partitions.get(guild.id).users if GIVEAWAY_LEVEL_BONUS > 0 else None
+    weights = []
+    for uid in entrants:
+        weight = 1.0
+        if table is not None:
+            slot = table.find(uid)
+            if slot is not None:
+                weight += table.levels[slot] * GIVEAWAY_LEVEL_BONUS
+        if GIVEAWAY_ROLE_MULTIPLIERS:
+            member = guild.get_member(uid)
+            if member is not None:
+                weight *= max((GIVEAWAY_ROLE_MULTIPLIERS.get(r.id, 1.0) for r in member.roles), default=1.0)
+        weights.append(weight)
+    return weights
 
 async def end_giveaway(bot_instance, message_id: int, manual=False):
     data = giveaways.pop(message_id, None)
     if not data:
         return
-    channel = bot_instance.get_channel(data["channel_id"])
-    if not channel:
-        return
-    try:
-        msg = await channel.fetch_message(message_id)
-    except Exception:
-        return
-    participants = list(data["participants"])
+    storage.remove_giveaway(giveaways, message_id)
+    msg = gw_scheduler.forget(message_id)
+    if msg is None:
+        channel = bot_instance.get_channel(data["channel_id"])
+        if not channel:
+            return
+        msg = channel.get_partial_message(message_id)
     winners_num = max(1, data["winners"])
-    if len(participants) == 0:
+    pool = WinnerPool(data["participants"], giveaway_weights(msg.guild, data["participants"]))
+    winners = pool.draw(winners_num)
+    if not winners:
         result_text = "No one participated."
-        winners = []
     else:
-        random.shuffle(participants)
-        winners = participants[:winners_num]
         winners_mentions = ", ".join(f"<@{w}>" for w in winners)
         result_text = f"Winner(s): {winners_mentions}"
-    rec = gw_records.get(message_id, {"prize": data["prize"], "participants": [], "won": [], "channel_id": data["channel_id"]})
-    part_set = set(rec.get("participants", []))
-    part_set.update(list(data["participants"]))
-    won_set = set(rec.get("won", []))
-    won_set.update(winners)
-    gw_records[message_id] = {
+    gw_records.put(message_id, {
         "prize": data["prize"],
-        "participants": list(part_set),
-        "won": list(won_set),
+        "pool": pool,
+        "won": array("q", winners),
         "channel_id": data["channel_id"]
+    })
+    embed = discord.Embed(
+        title=f"Giveaway ended — {winners_label(winners_num)}",
+        description=f"Prize: {data['prize']}\n{result_text}",
+        color=COLOR_BASE, timestamp=datetime.utcnow()
+    )
+    if THUMB_URL:
+        embed.set_thumbnail(url=THUMB_URL)
+    try:
+        await msg.edit(embed=embed, view=None)
+    except (discord.NotFound, discord.Forbidden):
+        return
+    await msg.channel.send(f"Giveaway ended — Prize: {data['prize']}\n{result_text}")
+
+class GiveawayScheduler:
+    def __init__(self, refresh: int, debounce: float):
+        self.refresh = refresh
+        self.debounce = debounce
+        self._heap = []
+        self._wake_at = {}
+        self._last_edit = {}
+        self._handles = {}
+        self._rendered = {}
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self.edits = 0
+        self.skipped = 0
+
+    def handle(self, message_id: int, data: dict):
+        msg = self._handles.get(message_id)
+        if msg is None:
+            channel = bot.get_channel(data["channel_id"])
+            if channel is None:
+                return None
+            msg = channel.get_partial_message(message_id)
+            self._handles[message_id] = msg
+        return msg
+
+    def _next_wake(self, end: float, now: float) -> float:
+        remaining = end - now
+        if remaining <= self.refresh:
+            return end
+        return end - (math.ceil(remaining / self.refresh) - 1) * self.refresh
+
+    def add(self, message_id: int, rendered: Optional[str] = None):
+        data = giveaways[message_id]
+        if rendered is not None:
+            self._rendered[message_id] = rendered
+        self._push(message_id, self._next_wake(data["end"], datetime.utcnow().timestamp()))
+
+    def _push(self, message_id: int, when: float):
+        self._wake_at[message_id] = when
+        heapq.heappush(self._heap, (when, message_id))
+        if self._heap[0][1] == message_id:
+            self._wakeup.set()
+
+    def touch(self, message_id: int):
+        if message_id not in giveaways:
+            return
+        due = max(datetime.utcnow().timestamp(), self._last_edit.get(message_id, 0.0) + self.debounce)
+        pending = self._wake_at.get(message_id)
+        if pending is not None and pending <= due:
+            return
+        self._push(message_id, due)
+
+    def forget(self, message_id: int):
+        self._wake_at.pop(message_id, None)
+        self._last_edit.pop(message_id, None)
+        self._rendered.pop(message_id, None)
+        return self._handles.pop(message_id, None)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def _refresh(self, message_id: int, data: dict, now: float):
+        embed = build_gw_embed(data, max(0, math.ceil(data["end"] - now)))
+        if self._rendered.get(message_id) == embed.description:
+            self.skipped += 1
+            return
+        msg = self.handle(message_id, data)
+        if msg is None:
+            return
+        self._last_edit[message_id] = now
+        await msg.edit(embed=embed)
+        self._rendered[message_id] = embed.description
+        self.edits += 1
+
+    async def _tick(self, message_id: int, now: float):
+        data = giveaways.get(message_id)
+        if data is None:
+            self.forget(message_id)
+            return
+        if now >= data["end"]:
+            self._wake_at.pop(message_id, None)
+            await end_giveaway(bot, message_id)
+            return
+        self._push(message_id, self._next_wake(data["end"], now))
+        await self._refresh(message_id, data, now)
+
+    async def _run(self):
+        await bot.wait_until_ready()
+        while not bot.is_closed():
+            self._wakeup.clear()
+            now = datetime.utcnow().timestamp()
+            while self._heap and self._heap[0][0] <= now:
+                when, message_id = heapq.heappop(self._heap)
+                if self._wake_at.get(message_id) != when:
+                    continue
+                try:
+                    await self._tick(message_id, now)
+                except Exception as e:
+                    print(f"giveaway {message_id} update failed: {e!r}")
+            timeout = self._heap[0][0] - datetime.utcnow().timestamp() if self._heap else None
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def summary(self) -> str:
+        return f"{len(self._wake_at)} scheduled • {self.edits} edits • {self.skipped} unchanged"
+
+gw_scheduler = GiveawayScheduler(GIVEAWAY_REFRESH_SECONDS, GIVEAWAY_EDIT_DEBOUNCE)
+
+def restore_giveaways():
+    giveaways.update(storage.load_giveaways())
+    for message_id in giveaways:
+        gw_scheduler.add(message_id)
+    return len(giveaways)
+
+TICKET_CATEGORY_NAMES = {"tickets", "support", "soporte"}
+TICKET_CATEGORIES = (
+    "category 1",
+    "category 2",
+    "category 3",
+    "category 4",
+    "category 5",
+    "category 6"
+)
+
+class TicketRouting:
+    def __init__(self):
+        self._guilds = {}
+        self._configured = {int(gid): int(cid) for gid, cid in storage.get_config("ticket_categories", {}).items()}
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def resolve(self, guild: discord.Guild) -> dict:
+        route = self._guilds.get(guild.id)
+        if route is not None:
+            self.hits += 1
+            return route
+        self.misses += 1
+        category = None
+        configured = self._configured.get(guild.id)
+        if configured:
+            category = guild.get_channel(configured)
+            if not isinstance(category, discord.CategoryChannel):
+                category = None
+        if category is None:
+            for c in guild.categories:
+                if c.name.lower() in TICKET_CATEGORY_NAMES:
+                    category = c
+                    break
+        staff = [r for r in guild.roles if r.permissions.manage_messages or r.permissions.administrator]
+        route = {"category": category, "staff": staff, "ping": staff[0] if staff else None}
+        self._guilds[guild.id] = route
+        return route
+
+    def configure(self, guild_id: int, category_id: Optional[int]):
+        if category_id is None:
+            self._configured.pop(guild_id, None)
+        else:
+            self._configured[guild_id] = category_id
+        storage.set_config("ticket_categories", {str(gid): cid for gid, cid in self._configured.items()})
+        self.invalidate(guild_id)
+
+    def configured(self, guild_id: int) -> Optional[int]:
+        return self._configured.get(guild_id)
+
+    def invalidate(self, guild_id: int):
+        if self._guilds.pop(guild_id, None) is not None:
+            self.invalidations += 1
+
+    def summary(self) -> str:
+        return f"{len(self._guilds)} guilds cached • {self.hits} hits / {self.misses} misses • {self.invalidations} invalidations"
+
+ticket_routes = TicketRouting()
+
+class TicketStore:
+    def __init__(self, by_creator: dict):
+        self.by_creator = by_creator
+        self.tickets = {}
+
+    def load(self):
+        self.tickets = storage.load_tickets()
+        self.by_creator.clear()
+        for channel_id, entry in self.tickets.items():
+            self.by_creator[entry["creator_id"]] = channel_id
+
+    def open(self, channel: discord.TextChannel, creator: discord.Member, category: str):
+        self.tickets[channel.id] = {"guild_id": channel.guild.id, "creator_id": creator.id, "category": category, "claimed_by": None}
+        self.by_creator[creator.id] = channel.id
+        storage.save_ticket(self.tickets, channel.id)
+
+    def get(self, channel_id: int):
+        return self.tickets.get(channel_id)
+
+    def claim(self, channel_id: int, user_id: int):
+        self.tickets[channel_id]["claimed_by"] = user_id
+        storage.save_ticket(self.tickets, channel_id)
+
+    def _drop(self, channel_id: int):
+        entry = self.tickets.pop(channel_id, None)
+        if entry and self.by_creator.get(entry["creator_id"]) == channel_id:
+            del self.by_creator[entry["creator_id"]]
+        return entry
+
+    def close(self, channel_id: int):
+        entry = self._drop(channel_id)
+        if entry:
+            storage.remove_tickets(self.tickets, [channel_id])
+        return entry
+
+    def reconcile(self):
+        gone = []
+        for channel_id, entry in list(self.tickets.items()):
+            guild = bot.get_guild(entry["guild_id"])
+            if guild is not None and guild.get_channel(channel_id) is None:
+                self._drop(channel_id)
+                gone.append(channel_id)
+        if gone:
+            storage.remove_tickets(self.tickets, gone)
+        return len(gone)
+
+ticket_store = TicketStore(open_tickets)
+closing_tickets = set()
+
+def _transcript_record(m: discord.Message) -> dict:
+    return {
+        "id": m.id,
+        "author_id": m.author.id,
+        "author": str(m.author),
+        "bot": m.author.bot,
+        "created_at": m.created_at.isoformat(),
+        "edited_at": m.edited_at.isoformat() if m.edited_at else None,
+        "content": m.content,
+        "attachments": [a.url for a in m.attachments],
+        "embeds": [e.to_dict() for e in m.embeds],
     }
-    embed = msg.embeds[0] if msg.embeds else discord.Embed(color=COLOR_BASE)
-    embed.title = f"Giveaway ended — {winners_label(winners_num)}"
-    embed.description = f"Prize: {data['prize']}\n{result_text}"
-    embed.timestamp = datetime.utcnow()
-    await msg.edit(embed=embed, view=None)
-    await channel.send(f"Giveaway ended — Prize: {data['prize']}\n{result_text}")
+
+async def export_transcript(channel: discord.TextChannel, progress=None, page_size: int = TRANSCRIPT_PAGE_SIZE):
+    os.makedirs(TRANSCRIPT_DIR, exist_ok=True)
+    stamp = datetime.utcnow().strftime("%Y%m%d-%H%M%S")
+    path = os.path.join(TRANSCRIPT_DIR, f"{channel.guild.id}-{channel.id}-{stamp}.jsonl.gz")
+    count = 0
+    after = None
+    with gzip.open(path + ".tmp", "wt", encoding="utf-8") as out:
+        while True:
+            page = [m async for m in channel.history(limit=page_size, after=after, oldest_first=True)]
+            if not page:
+                break
+            out.write("".join(json.dumps(_transcript_record(m), ensure_ascii=False) + "\n" for m in page))
+            count += len(page)
+            after = page[-1]
+            if progress:
+                await progress(count)
+            if len(page) < page_size:
+                break
+    os.replace(path + ".tmp", path)
+    return path, count
+
+async def archive_transcript(channel: discord.TextChannel, path: str, count: int, entry: Optional[dict]):
+    log_channel = bot.get_channel(TRANSCRIPT_LOG_CHANNEL) if TRANSCRIPT_LOG_CHANNEL else None
+    if log_channel is None:
+        return False
+    if os.path.getsize(path) > getattr(log_channel.guild, "filesize_limit", 8 * 1024 * 1024):
+        await log_channel.send(f"Transcript of #{channel.name} ({count} messages) is too large to upload; saved as {os.path.basename(path)}.")
+        return False
+    creator = f"<@{entry['creator_id']}>" if entry else "unknown"
+    await log_channel.send(
+        f"Transcript of #{channel.name} — opened by {creator}, {count} messages.",
+        file=discord.File(path, filename=os.path.basename(path)),
+        allowed_mentions=discord.AllowedMentions.none()
+    )
+    return True
 
 class TicketManageView(discord.ui.View):
-    def __init__(self, creator: discord.Member):
+    def __init__(self):
         super().__init__(timeout=None)
-        self.creator = creator
-        self.claimed_by = None
-        close_button = discord.ui.Button(label="Close", style=discord.ButtonStyle.danger, emoji="🗑️")
-        close_button.callback = self.close_callback
-        self.add_item(close_button)
-        claim_button = discord.ui.Button(label="Claim", style=discord.ButtonStyle.success, emoji="🛠️")
-        claim_button.callback = self.claim_callback
-        self.add_item(claim_button)
+
+    @discord.ui.button(label="Close", style=discord.ButtonStyle.danger, emoji="🗑️", custom_id="ticket_close")
+    async def close_button(self, interaction: discord.Interaction, _):
+        await self.close_callback(interaction)
+
+    @discord.ui.button(label="Claim", style=discord.ButtonStyle.success, emoji="🛠️", custom_id="ticket_claim")
+    async def claim_button(self, interaction: discord.Interaction, _):
+        await self.claim_callback(interaction)
 
     async def claim_callback(self, interaction: discord.Interaction):
-        if not (interaction.user.guild_permissions.manage_messages or interaction.user.guild_permissions.administrator):
+        if not perm_cache.is_mod(interaction.user):
             return await interaction.response.send_message("Only moderation can claim tickets.", ephemeral=True)
-        if self.claimed_by is None:
-            self.claimed_by = interaction.user
+        entry = ticket_store.get(interaction.channel.id)
+        if entry is None:
+            return await interaction.response.send_message("This channel is no longer an open ticket.", ephemeral=True)
+        if entry["claimed_by"] is None:
+            ticket_store.claim(interaction.channel.id, interaction.user.id)
             await interaction.response.send_message(f"Ticket claimed by {interaction.user.mention}", ephemeral=False)
         else:
-            await interaction.response.send_message(f"This ticket is already claimed by {self.claimed_by.mention}", ephemeral=True)
+            await interaction.response.send_message(f"This ticket is already claimed by <@{entry['claimed_by']}>", ephemeral=True)
 
     async def close_callback(self, interaction: discord.Interaction):
-        if not (interaction.user.guild_permissions.manage_messages or interaction.user.guild_permissions.administrator):
+        if not perm_cache.is_mod(interaction.user):
             return await interaction.response.send_message("Only moderation can close tickets.", ephemeral=True)
-        await interaction.response.send_message("Closing ticket...", ephemeral=True)
-        await asyncio.sleep(2)
-        user_id = self.creator.id
-        open_tickets.pop(user_id, None)
-        ticket_cooldown[user_id] = asyncio.get_event_loop().time() + 20
-        await interaction.channel.delete(reason="Ticket closed")
+        channel = interaction.channel
+        if channel.id in closing_tickets:
+            return await interaction.response.send_message("This ticket is already being closed.", ephemeral=True)
+        closing_tickets.add(channel.id)
+        try:
+            await interaction.response.send_message("Closing ticket... exporting transcript.", ephemeral=True)
+            status = await channel.send("Exporting transcript: 0 messages")
+            last_edit = 0.0
+
+            async def progress(count: int):
+                nonlocal last_edit
+                now = time.monotonic()
+                if now - last_edit >= 2:
+                    last_edit = now
+                    await status.edit(content=f"Exporting transcript: {count} messages")
+
+            try:
+                path, count = await export_transcript(channel, progress)
+            except (discord.HTTPException, OSError) as e:
+                print(f"transcript export for {channel.id} failed: {e!r}")
+                return await status.edit(content="Transcript export failed, so the ticket was kept open. Try closing it again.")
+            await status.edit(content=f"Transcript saved: {count} messages. Deleting channel...")
+            try:
+                await archive_transcript(channel, path, count, ticket_store.get(channel.id))
+            except (discord.HTTPException, OSError) as e:
+                print(f"transcript upload for {channel.id} failed, kept at {path}: {e!r}")
+            await asyncio.sleep(2)
+        finally:
+            closing_tickets.discard(channel.id)
+        entry = ticket_store.close(channel.id)
+        if entry:
+            ticket_cooldown[entry["creator_id"]] = asyncio.get_event_loop().time() + 20
+        await channel.delete(reason="Ticket closed")
 
 class TicketView(discord.ui.View):
     def __init__(self):
         super().__init__(timeout=None)
-        self.categories = [
-            "category 1",
-            "category 2",
-            "category 3",
-            "category 4",
-            "category 5",
-            "category 6"
-        ]
+        self.categories = list(TICKET_CATEGORIES)
         for cat in self.categories:
-            self.add_item(discord.ui.Button(label=cat, style=discord.ButtonStyle.primary, custom_id=cat))
+            self.add_item(discord.ui.Button(label=cat, style=discord.ButtonStyle.primary, custom_id=f"ticket:{cat}"))
 
 @bot.command()
 @commands.has_permissions(manage_channels=True)
@@ -361,20 +2408,40 @@ async def ticket_error(ctx, error):
     if isinstance(error, commands.MissingPermissions):
         await ctx.reply(f"{ctx.author.mention}, Manage Channels is required.", mention_author=False, delete_after=10)
 
+@bot.command(name="ticketcategory")
+@commands.has_permissions(manage_channels=True)
+async def ticketcategory(ctx, *, category: str = None):
+    if not category:
+        configured = ticket_routes.configured(ctx.guild.id)
+        current = ctx.guild.get_channel(configured) if configured else None
+        resolved = ticket_routes.resolve(ctx.guild)["category"]
+        text = f"Configured category: {current.name if current else 'none'}\nTickets are created in: {resolved.name if resolved else 'no category'}"
+        return await ctx.send(f"{text}\nUsage: {BOT_PREFIX}ticketcategory <category name or ID | none>")
+    if category.lower() == "none":
+        ticket_routes.configure(ctx.guild.id, None)
+        return await ctx.send("Ticket category reset. Tickets go to a category named tickets/support/soporte if one exists.")
+    try:
+        target = await commands.CategoryChannelConverter().convert(ctx, category)
+    except commands.BadArgument:
+        return await ctx.send("I can't find that category.", delete_after=10)
+    ticket_routes.configure(ctx.guild.id, target.id)
+    await ctx.send(f"New tickets will be created in {target.name}.")
+
+@ticketcategory.error
+async def ticketcategory_error(ctx, error):
+    if isinstance(error, commands.MissingPermissions):
+        await ctx.reply(f"{ctx.author.mention}, Manage Channels is required.", mention_author=False, delete_after=10)
+
 @bot.event
 async def on_interaction(interaction: discord.Interaction):
-    if not interaction.data or not interaction.data.get("custom_id"):
-        return
-    category = interaction.data["custom_id"]
-    valid_categories = [
-        "category 1",
-        "category 2",
-        "category 3",
-        "category 4",
-        "category 5",
-        "category 6"
-    ]
-    if category not in valid_categories:
+    await interaction_router.dispatch(interaction)
+
+for _cat in TICKET_CATEGORIES:
+    interaction_router.alias(_cat, "ticket", _cat)
+
+@interaction_router.route("ticket")
+async def _route_ticket(interaction: discord.Interaction, category: str):
+    if category not in TICKET_CATEGORIES or interaction.guild is None:
         return
     guild = interaction.guild
     member = interaction.user
@@ -386,19 +2453,15 @@ async def on_interaction(interaction: discord.Interaction):
     if ticket_cooldown.get(member.id, 0) > now:
         remaining = int(ticket_cooldown[member.id] - now)
         return await interaction.response.send_message(f"You must wait {remaining} seconds to open another ticket.", ephemeral=True)
-    category_obj = None
-    for c in guild.categories:
-        if c.name.lower() in {"tickets", "support", "soporte"}:
-            category_obj = c
-            break
+    route = ticket_routes.resolve(guild)
+    category_obj = route["category"]
     channel_name = f"{category} | {member.name}"
     overwrites = {
         guild.default_role: discord.PermissionOverwrite(view_channel=False),
         member: discord.PermissionOverwrite(view_channel=True, send_messages=True)
     }
-    for r in guild.roles:
-        if r.permissions.manage_messages or r.permissions.administrator:
-            overwrites[r] = discord.PermissionOverwrite(view_channel=True, send_messages=True)
+    for r in route["staff"]:
+        overwrites[r] = discord.PermissionOverwrite(view_channel=True, send_messages=True)
     new_channel = await guild.create_text_channel(
         name=channel_name,
         category=category_obj,
@@ -406,8 +2469,8 @@ async def on_interaction(interaction: discord.Interaction):
         topic=f"Ticket from {member} - {category} ",
         reason=f"Ticket created by {member}"
     )
-    open_tickets[member.id] = new_channel.id
-    view = TicketManageView(creator=member)
+    ticket_store.open(new_channel, member, category)
+    view = TicketManageView()
     embed_ticket = discord.Embed(
         title=f"Ticket - {category}",
         description="Choose an option using the buttons below.",
@@ -416,11 +2479,7 @@ async def on_interaction(interaction: discord.Interaction):
     )
     if THUMB_URL:
         embed_ticket.set_thumbnail(url=THUMB_URL)
-    role_ping = None
-    for r in guild.roles:
-        if r.permissions.manage_messages or r.permissions.administrator:
-            role_ping = r
-            break
+    role_ping = route["ping"]
     mention_text = role_ping.mention if role_ping else ""
     await new_channel.send(content=f"{member.mention} {mention_text}".strip(), embed=embed_ticket, view=view)
     await interaction.response.send_message(f"Ticket created: {new_channel.mention}", ephemeral=True)
@@ -429,21 +2488,23 @@ async def on_interaction(interaction: discord.Interaction):
 async def help_cmd(ctx):
     categories = {
         "🎫 Ticket": {
-            f"{BOT_PREFIX}ticket": "Send the ticket panel (only admin can use this)."
+            f"{BOT_PREFIX}ticket": "Send the ticket panel (only admin can use this).",
+            f"{BOT_PREFIX}ticketcategory [category | none]": "Set the category new tickets are created in."
         },
         "🧹 Moderation": {
-            f"{BOT_PREFIX}purge <amount>": "Delete messages in the channel.",
+            f"{BOT_PREFIX}purge <amount> [filters]": "Delete messages (filters: user:@x bots regex:pat attachments links before:id after:id).",
             f"{BOT_PREFIX}nuke [reason]": "Recreate the channel from scratch.",
             f"{BOT_PREFIX}ban [@user] [reason]": "Ban a user.",
             f"{BOT_PREFIX}kick [@user] [reason]": "Kick a user.",
             f"{BOT_PREFIX}unban <id or name#discrim>": "Unban a user.",
+            f"{BOT_PREFIX}massunban [reason:pat] [before:date] [after:date] [confirm]": "Unban every matching ban.",
             f"{BOT_PREFIX}warn [@user] [reason]": "Warn a user.",
             f"{BOT_PREFIX}warnings [@user]": "Show a user's warnings.",
             f"{BOT_PREFIX}warnremove <ID>": "Remove a warning by its ID.",
             f"{BOT_PREFIX}lock [#channel]": "Lock a channel.",
             f"{BOT_PREFIX}unlock [#channel]": "Unlock a channel.",
             f"{BOT_PREFIX}slowmode <sec>": "Set channel slowmode.",
-            f'{BOT_PREFIX}poll "Question" op1 | op2': "Create a quick poll.",
+            f'{BOT_PREFIX}poll [duration] "Question" op1 | op2': "Create a poll (up to 25 options, optional duration).",
             f"{BOT_PREFIX}gwstart <duration> <prize> [n]": "Start a giveaway.",
             f"{BOT_PREFIX}gwend": "End an active giveaway.",
             f"{BOT_PREFIX}gwreroll": "Reroll a giveaway.",
@@ -473,7 +2534,9 @@ async def help_cmd(ctx):
             f"{BOT_PREFIX}antilink status": "Filter status.",
             f"{BOT_PREFIX}antilink whitelist add @user": "Add to whitelist.",
             f"{BOT_PREFIX}antilink whitelist remove @user": "Remove from whitelist.",
-            f"{BOT_PREFIX}antilink whitelist list": "List whitelist."
+            f"{BOT_PREFIX}antilink whitelist list": "List whitelist.",
+            f"{BOT_PREFIX}antilink allow add/remove/list <domain>": "Domains always allowed in this server.",
+            f"{BOT_PREFIX}antilink block add/remove/list <domain>": "Domains always blocked, even without http/www."
         },
         "🏅 Levels": {
             f"{BOT_PREFIX}rank [@user]": "Your level and progress.",
@@ -604,24 +2667,159 @@ async def help_cmd(ctx):
     msg = await ctx.send(embed=view.current_embed, view=view)
     view.message = msg
 
+def parse_purge_filters(tokens):
+    checks = []
+    before = after = None
+    filtered = False
+    for token in tokens:
+        key, _, value = token.partition(":")
+        key = key.lower()
+        if key == "user" and value:
+            uid = int(re.sub(r"[^0-9]", "", value) or 0)
+            if not uid:
+                raise ValueError(f"Invalid user: {value}")
+            checks.append(lambda m, uid=uid: m.author.id == uid)
+        elif key == "bots" and not value:
+            checks.append(lambda m: m.author.bot)
+        elif key == "regex" and value:
+            try:
+                pattern = re.compile(value, re.IGNORECASE)
+            except re.error as e:
+                raise ValueError(f"Invalid regex: {e}")
+            checks.append(lambda m, pattern=pattern: bool(pattern.search(m.content or "")))
+        elif key == "attachments" and not value:
+            checks.append(lambda m: bool(m.attachments))
+        elif key == "links" and not value:
+            checks.append(lambda m: bool(LINK_REGEX.search(m.content or "")))
+        elif key in ("before", "after") and value.isdigit():
+            if key == "before":
+                before = discord.Object(id=int(value))
+            else:
+                after = discord.Object(id=int(value))
+            continue
+        else:
+            raise ValueError(f"Unknown filter: {token}")
+        filtered = True
+    check = (lambda m: all(c(m) for c in checks)) if checks else (lambda m: True)
+    return check, before, after, filtered
+
+async def run_purge(channel, amount: int, check, before=None, after=None, scan_limit=None, progress=None):
+    cutoff = discord.utils.utcnow() - timedelta(days=14) + timedelta(minutes=1)
+    tally = Counter()
+    names = {}
+    deleted = scanned = matched = failed = 0
+    batch = []
+
+    def lost(msgs):
+        nonlocal failed
+        failed += len(msgs)
+        tally.subtract(m.author.id for m in msgs)
+
+    async def flush():
+        nonlocal deleted
+        try:
+            if len(batch) == 1:
+                try:
+                    await batch[0].delete()
+                except discord.NotFound:
+                    pass
+            elif batch:
+                await channel.delete_messages(batch)
+            deleted += len(batch)
+        except discord.Forbidden:
+            raise
+        except discord.HTTPException:
+            lost(batch)
+        batch.clear()
+
+    async for msg in channel.history(limit=scan_limit, before=before, after=after):
+        scanned += 1
+        if check(msg):
+            matched += 1
+            tally[msg.author.id] += 1
+            names.setdefault(msg.author.id, msg.author.mention)
+            if msg.created_at > cutoff:
+                batch.append(msg)
+                if len(batch) == 100:
+                    await flush()
+            else:
+                await flush()
+                try:
+                    await msg.delete()
+                    deleted += 1
+                except discord.NotFound:
+                    pass
+                except discord.Forbidden:
+                    raise
+                except discord.HTTPException:
+                    lost([msg])
+                await asyncio.sleep(PURGE_OLD_DELAY)
+        if progress:
+            await progress(deleted + len(batch), scanned)
+        if matched >= amount:
+            break
+    await flush()
+    return deleted, scanned, failed, +tally, names
+
+def purge_tally_text(tally: Counter, names: dict, limit: int = 10) -> str:
+    if not tally:
+        return "No messages"
+    lines = [f"{names[uid]} — {n}" for uid, n in tally.most_common(limit)]
+    if len(tally) > limit:
+        rest = sum(n for _, n in tally.most_common()[limit:])
+        lines.append(f"+{len(tally) - limit} more authors ({rest} messages)")
+    return "\n".join(lines)[:1024]
+
 @bot.command(name="purge")
 @commands.has_permissions(manage_messages=True)
-async def purge(ctx, amount: int):
+async def purge(ctx, amount: int, *, filters: str = ""):
     if amount < 1:
         return await ctx.send("You must specify an amount greater than 0.", delete_after=5)
+    usage = (f"Usage: {BOT_PREFIX}purge <amount> [user:@member] [bots] [regex:pattern] [attachments] [links] "
+             f"[before:message_id] [after:message_id]")
+    try:
+        check, before, after, filtered = parse_purge_filters(shlex.split(filters))
+    except ValueError as e:
+        return await ctx.send(f"{e}\n{usage}", delete_after=15)
     await ctx.message.delete()
-    deleted = await ctx.channel.purge(limit=amount)
-    authors = [msg.author.mention for msg in deleted if not msg.author.bot]
-    unique_authors = list(dict.fromkeys(authors))
-    authors_text = ", ".join(unique_authors) or "No user messages"
+    status = None
+    last_edit = 0.0
+    if amount >= PURGE_PROGRESS_THRESHOLD:
+        status = await ctx.send(f"Purging... 0/{amount} deleted")
+
+    async def progress(done: int, scanned: int):
+        nonlocal last_edit
+        now = time.monotonic()
+        if status and now - last_edit >= 3:
+            last_edit = now
+            await status.edit(content=f"Purging... {done}/{amount} deleted ({scanned} scanned)")
+
+    scan_limit = max(amount, PURGE_MAX_SCAN) if filtered else amount
+    try:
+        deleted, scanned, failed, tally, names = await run_purge(
+            ctx.channel, amount, check, before=before or ctx.message, after=after, scan_limit=scan_limit, progress=progress
+        )
+    except discord.Forbidden:
+        return await ctx.send("I don't have permission to delete messages in this channel.", delete_after=10)
+    finally:
+        if status:
+            try:
+                await status.delete()
+            except discord.HTTPException:
+                pass
+    summary = f"{deleted} messages deleted ({scanned} scanned)."
+    if failed:
+        summary += f"\n{failed} messages could not be deleted."
     embed = discord.Embed(
         title="Purge complete",
-        description=f"{len(deleted)} messages deleted.",
+        description=summary,
         color=COLOR_BASE,
         timestamp=datetime.utcnow()
     )
     embed.add_field(name="Executed by", value=ctx.author.mention, inline=False)
-    embed.add_field(name="Affected authors", value=authors_text, inline=False)
+    if filters:
+        embed.add_field(name="Filters", value=filters[:1024], inline=False)
+    embed.add_field(name="Affected authors", value=purge_tally_text(tally, names), inline=False)
     if THUMB_URL:
         embed.set_thumbnail(url=THUMB_URL)
     embed.set_footer(text=f"Requested by {ctx.author}")
@@ -696,6 +2894,85 @@ async def nuke(ctx, *, reason: str = "No reason"):
     view = ConfirmNuke(ctx.author, message)
     await message.edit(view=view)
 
+class BanIndex:
+    def __init__(self):
+        self._guilds = {}
+        self._loading = {}
+        self.loads = 0
+        self.lookups = 0
+
+    def _state(self, guild_id: int) -> dict:
+        return self._guilds.setdefault(guild_id, {"by_id": {}, "by_name": {}, "ready": False})
+
+    def _put(self, state: dict, user, reason=None, banned_at=None):
+        entry = state["by_id"].get(user.id)
+        if entry is None:
+            entry = state["by_id"][user.id] = {"user": user, "reason": None, "banned_at": None}
+        else:
+            entry["user"] = user
+        if reason is not None:
+            entry["reason"] = reason
+        if banned_at is not None:
+            entry["banned_at"] = banned_at
+        state["by_name"][str(user).lower()] = user.id
+        state["by_name"][user.name.lower()] = user.id
+
+    async def _load(self, guild: discord.Guild):
+        state = self._state(guild.id)
+        async for ban_entry in guild.bans(limit=None):
+            self._put(state, ban_entry.user, reason=ban_entry.reason or "")
+        state["ready"] = True
+        self.loads += 1
+
+    def warm(self, guild: discord.Guild) -> asyncio.Task:
+        task = self._loading.get(guild.id)
+        if task is None or (task.done() and not self._state(guild.id)["ready"]):
+            task = asyncio.get_running_loop().create_task(self._load(guild))
+            # background warms are never awaited; retrieve the error so a
+            # failed load is retried by the next ensure() instead of logged
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+            self._loading[guild.id] = task
+        return task
+
+    async def ensure(self, guild: discord.Guild) -> Optional[dict]:
+        state = self._state(guild.id)
+        if not state["ready"]:
+            try:
+                await self.warm(guild)
+            except discord.HTTPException:
+                return None
+        return state
+
+    def added(self, guild_id: int, user, reason=None):
+        state = self._guilds.get(guild_id)
+        if state is not None:
+            self._put(state, user, reason=reason, banned_at=discord.utils.utcnow())
+
+    def removed(self, guild_id: int, user_id: int):
+        state = self._guilds.get(guild_id)
+        if state is None:
+            return
+        entry = state["by_id"].pop(user_id, None)
+        if entry:
+            for key in (str(entry["user"]).lower(), entry["user"].name.lower()):
+                if state["by_name"].get(key) == user_id:
+                    del state["by_name"][key]
+
+    def find(self, state: dict, query: str):
+        self.lookups += 1
+        query = query.strip()
+        digits = query.strip("<@!>")
+        if digits.isdigit():
+            return state["by_id"].get(int(digits))
+        uid = state["by_name"].get(query.lower())
+        return state["by_id"].get(uid) if uid is not None else None
+
+    def summary(self) -> str:
+        bans = sum(len(st["by_id"]) for st in self._guilds.values())
+        return f"{len(self._guilds)} guilds • {bans} bans indexed • {self.loads} loads • {self.lookups} lookups"
+
+ban_index = BanIndex()
+
 @bot.command(name="ban")
 @commands.has_permissions(ban_members=True)
 async def ban(ctx, *, arg: str = None):
@@ -727,6 +3004,7 @@ async def ban(ctx, *, arg: str = None):
         pass
     try:
         await member.ban(reason=real_reason)
+        ban_index.added(ctx.guild.id, member, reason=real_reason)
         embed = discord.Embed(title="User banned", color=COLOR_BASE, timestamp=datetime.utcnow())
         embed.add_field(name="User", value=member.mention, inline=False)
         embed.add_field(name="Banned by", value=ctx.author.mention, inline=False)
@@ -781,39 +3059,130 @@ async def kick(ctx, *, arg: str = None):
             embed.set_thumbnail(url=THUMB_URL)
         await ctx.send(embed=embed)
     except discord.Forbidden:
-        embed_error = discord.Embed(title="Error", description="Insufficient permission to kick.", color=COLOR_ERR, timestamp=datetime.utcnow())
+        embed_error = discord.Embed(title="Error", description="Insufficient permission to kick.", color=COLOR_ERR, timestamp=datetime.utcnow())
+        await ctx.send(embed=embed_error)
+    except discord.HTTPException:
+        embed_error = discord.Embed(title="Error", description="I could not kick the user.", color=COLOR_ERR, timestamp=datetime.utcnow())
+        await ctx.send(embed=embed_error)
+
+@bot.command(name="unban")
+@commands.has_permissions(ban_members=True)
+async def unban(ctx, *, user: str):
+    state = await ban_index.ensure(ctx.guild)
+    if state is None:
+        embed_error = discord.Embed(title="Error", description="I could not read the ban list.", color=COLOR_ERR, timestamp=datetime.utcnow())
+        return await ctx.send(embed=embed_error)
+    entry = ban_index.find(state, user)
+    if entry is None:
+        embed_notfound = discord.Embed(title="User not found", description="Not in the ban list.", color=COLOR_ERR, timestamp=datetime.utcnow())
+        return await ctx.send(embed=embed_notfound)
+    ban_user = entry["user"]
+    try:
+        await ctx.guild.unban(ban_user)
+        ban_index.removed(ctx.guild.id, ban_user.id)
+        embed = discord.Embed(title="User unbanned", color=0x2bff00, timestamp=datetime.utcnow())
+        embed.add_field(name="User", value=f"{ban_user} ({ban_user.id})", inline=False)
+        embed.add_field(name="Unbanned by", value=ctx.author.mention, inline=False)
+        if THUMB_URL:
+            embed.set_thumbnail(url=THUMB_URL)
+        await ctx.send(embed=embed)
+    except discord.NotFound:
+        ban_index.removed(ctx.guild.id, ban_user.id)
+        embed_notfound = discord.Embed(title="User not found", description="Not in the ban list.", color=COLOR_ERR, timestamp=datetime.utcnow())
+        await ctx.send(embed=embed_notfound)
+    except discord.Forbidden:
+        embed_error = discord.Embed(title="Error", description="Insufficient permission to unban.", color=COLOR_ERR, timestamp=datetime.utcnow())
         await ctx.send(embed=embed_error)
     except discord.HTTPException:
-        embed_error = discord.Embed(title="Error", description="I could not kick the user.", color=COLOR_ERR, timestamp=datetime.utcnow())
+        embed_error = discord.Embed(title="Error", description="I could not unban the user.", color=COLOR_ERR, timestamp=datetime.utcnow())
         await ctx.send(embed=embed_error)
 
-@bot.command(name="unban")
+def _parse_ban_date(value: str) -> datetime:
+    return datetime.strptime(value, "%Y-%m-%d").replace(tzinfo=timezone.utc)
+
+async def ban_dates_from_audit_log(guild: discord.Guild, since: datetime) -> dict:
+    dates = {}
+    async for log in guild.audit_logs(limit=None, action=discord.AuditLogAction.ban, after=since):
+        if log.target is not None:
+            dates[log.target.id] = max(dates.get(log.target.id, log.created_at), log.created_at)
+    return dates
+
+@bot.command(name="massunban")
 @commands.has_permissions(ban_members=True)
-async def unban(ctx, *, user: str):
-    user = user.strip()
-    found = False
-    async for ban_entry in ctx.guild.bans():
-        ban_user = ban_entry.user
-        if user == str(ban_user.id) or user.lower() == str(ban_user).lower():
-            found = True
+async def massunban(ctx, *, filters: str = ""):
+    usage = (f"Usage: {BOT_PREFIX}massunban [reason:pattern] [before:YYYY-MM-DD] [after:YYYY-MM-DD] [confirm]\n"
+             f"Run it without confirm first to see how many bans match.")
+    pattern = before = after = None
+    confirm = False
+    try:
+        for token in shlex.split(filters):
+            key, _, value = token.partition(":")
+            key = key.lower()
+            if key == "reason" and value:
+                pattern = re.compile(value, re.IGNORECASE)
+            elif key == "before" and value:
+                before = _parse_ban_date(value)
+            elif key == "after" and value:
+                after = _parse_ban_date(value)
+            elif key == "confirm" and not value:
+                confirm = True
+            else:
+                raise ValueError(f"Unknown filter: {token}")
+    except (ValueError, re.error) as e:
+        return await ctx.send(f"{e}\n{usage}", delete_after=15)
+    if pattern is None and before is None and after is None:
+        return await ctx.send("Give at least one filter.\n" + usage, delete_after=15)
+    status = await ctx.send("Loading the ban list...")
+    state = await ban_index.ensure(ctx.guild)
+    if state is None:
+        return await status.edit(content="I could not read the ban list.")
+    dates = {}
+    if before is not None or after is not None:
+        await status.edit(content="Reading ban dates from the audit log...")
+        try:
+            dates = await ban_dates_from_audit_log(ctx.guild, after or discord.utils.snowflake_time(0))
+        except discord.Forbidden:
+            return await status.edit(content="I need the View Audit Log permission to filter by ban date.")
+    targets = []
+    for uid, entry in state["by_id"].items():
+        if pattern is not None and not pattern.search(entry["reason"] or ""):
+            continue
+        banned_at = entry["banned_at"] or dates.get(uid)
+        if after is not None and (banned_at is None or banned_at < after):
+            continue
+        if before is not None and banned_at is not None and banned_at >= before:
+            continue
+        targets.append(entry["user"])
+    if not confirm:
+        note = "\nBans older than the audit log (45 days) have no date and count as before any date." if before else ""
+        return await status.edit(content=f"{len(targets)} of {len(state['by_id'])} bans match. Add confirm to unban them.{note}")
+    done = failed = 0
+    last_edit = 0.0
+    pending = iter(targets)
+
+    async def worker():
+        nonlocal done, failed, last_edit
+        for user in pending:
             try:
-                await ctx.guild.unban(ban_user)
-                embed = discord.Embed(title="User unbanned", color=0x2bff00, timestamp=datetime.utcnow())
-                embed.add_field(name="User", value=f"{ban_user} ({ban_user.id})", inline=False)
-                embed.add_field(name="Unbanned by", value=ctx.author.mention, inline=False)
-                if THUMB_URL:
-                    embed.set_thumbnail(url=THUMB_URL)
-                await ctx.send(embed=embed)
-            except discord.Forbidden:
-                embed_error = discord.Embed(title="Error", description="Insufficient permission to unban.", color=COLOR_ERR, timestamp=datetime.utcnow())
-                await ctx.send(embed=embed_error)
+                await ctx.guild.unban(user, reason=f"Mass unban by {ctx.author}")
+                ban_index.removed(ctx.guild.id, user.id)
+                done += 1
+            except discord.NotFound:
+                ban_index.removed(ctx.guild.id, user.id)
             except discord.HTTPException:
-                embed_error = discord.Embed(title="Error", description="I could not unban the user.", color=COLOR_ERR, timestamp=datetime.utcnow())
-                await ctx.send(embed=embed_error)
-            break
-    if not found:
-        embed_notfound = discord.Embed(title="User not found", description="Not in the ban list.", color=COLOR_ERR, timestamp=datetime.utcnow())
-        await ctx.send(embed=embed_notfound)
+                failed += 1
+            now = time.monotonic()
+            if now - last_edit >= 3:
+                last_edit = now
+                await status.edit(content=f"Unbanning... {done + failed}/{len(targets)}")
+
+    await asyncio.gather(*(worker() for _ in range(min(UNBAN_CONCURRENCY, len(targets)))))
+    embed = discord.Embed(title="Mass unban complete", description=f"{done} users unbanned, {failed} failed.", color=0x2bff00, timestamp=datetime.utcnow())
+    embed.add_field(name="Filters", value=filters[:1024], inline=False)
+    embed.add_field(name="Executed by", value=ctx.author.mention, inline=False)
+    if THUMB_URL:
+        embed.set_thumbnail(url=THUMB_URL)
+    await status.edit(content=None, embed=embed)
 
 @bot.command(name="lock")
 @commands.has_permissions(manage_channels=True)
@@ -981,22 +3350,12 @@ async def userinfo(ctx, *, arg: str = None):
             await interaction.response.send_message(embed=e, ephemeral=True)
         @discord.ui.button(label="Warnings", style=discord.ButtonStyle.danger, emoji="⚠️")
         async def warns_btn(self, interaction: discord.Interaction, _):
-            user_warns = warns_db.get(str(self.target_member.id), [])
-            if not user_warns:
-                desc = "This user has no warnings."
+            view = WarningsView(interaction.user, self.target_member, interaction.guild)
+            if view.pages > 1:
+                await interaction.response.send_message(embed=view.build_embed(), view=view)
+                view.message = await interaction.original_response()
             else:
-                lines = []
-                for w in user_warns[:10]:
-                    mod = interaction.guild.get_member(int(w.get("moderator", 0))) if w.get("moderator") else None
-                    mod_txt = mod.mention if mod else f"`{w.get('moderator','?')}`"
-                    lines.append(f"• ID: `{w['id']}` — Reason: {w.get('reason','') } — Mod: {mod_txt} — {w.get('date','')}")
-                extra = f"\n\n… and {len(user_warns)-10} more." if len(user_warns) > 10 else ""
-                desc = "\n".join(lines) + extra
-            e = discord.Embed(title=f"Warnings for {self.target_member.display_name}", description=desc, color=COLOR_BASE, timestamp=datetime.utcnow())
-            if THUMB_URL:
-                e.set_thumbnail(url=THUMB_URL)
-            e.set_footer(text=f"Requested by {interaction.user}")
-            await interaction.response.send_message(embed=e, ephemeral=False)
+                await interaction.response.send_message(embed=view.build_embed())
         @discord.ui.button(label="Avatar", style=discord.ButtonStyle.secondary, emoji="🖼️")
         async def avatar_btn(self, interaction: discord.Interaction, _):
             if not self.target_member.avatar:
@@ -1070,13 +3429,15 @@ async def warn(ctx, user: discord.Member = None, *, reason=None):
     warn_id = generate_warn_id()
     if str(user.id) not in warns_db:
         warns_db[str(user.id)] = []
-    warns_db[str(user.id)].append({
+    entry = {
         "id": warn_id,
         "moderator": str(ctx.author.id),
         "reason": reason,
         "date": datetime.utcnow().strftime("%d/%m/%Y %H:%M:%S")
-    })
-    save_warns()
+    }
+    warns_db[str(user.id)].append(entry)
+    warn_index.add(warn_id, str(user.id))
+    storage.add_warn(warns_db, str(user.id), entry)
     embed = discord.Embed(title="User Warned", color=COLOR_WARN, timestamp=datetime.utcnow())
     embed.add_field(name="User", value=f"{user.mention} ({user.id})", inline=False)
     embed.add_field(name="Moderator", value=f"{ctx.author.mention}", inline=False)
@@ -1087,30 +3448,100 @@ async def warn(ctx, user: discord.Member = None, *, reason=None):
     embed.set_footer(text=f"Requested by {ctx.author}")
     await ctx.send(embed=embed)
 
+class WarningsView(discord.ui.View):
+    def __init__(self, invoker: discord.abc.User, target: discord.abc.User, guild: discord.Guild, page_size: int = WARNINGS_PAGE_SIZE):
+        super().__init__(timeout=180)
+        self.invoker = invoker
+        self.target = target
+        self.guild = guild
+        self.page_size = max(1, min(25, page_size))
+        self.page = 0
+        self.message = None
+        self._mods = {}
+        self._sync_buttons()
+
+    @property
+    def warns(self):
+        return warns_db.get(str(self.target.id), [])
+
+    @property
+    def pages(self) -> int:
+        return max(1, math.ceil(len(self.warns) / self.page_size))
+
+    def _moderator(self, mod_id) -> str:
+        if not mod_id:
+            return "Unknown"
+        if mod_id not in self._mods:
+            mod = self.guild.get_member(int(mod_id)) if str(mod_id).isdigit() else None
+            self._mods[mod_id] = mod.mention if mod else f"`{mod_id}`"
+        return self._mods[mod_id]
+
+    def _sync_buttons(self):
+        self.page = max(0, min(self.page, self.pages - 1))
+        self.prev_page.disabled = self.page == 0
+        self.next_page.disabled = self.page >= self.pages - 1
+
+    def build_embed(self) -> discord.Embed:
+        name = getattr(self.target, "display_name", str(self.target))
+        embed = discord.Embed(title=f"Warnings for {name}", color=COLOR_BASE, timestamp=datetime.utcnow())
+        warns = self.warns
+        if not warns:
+            embed.description = "This user has no warnings."
+        else:
+            embed.description = f"{len(warns)} warning(s)"
+            start = self.page * self.page_size
+            for w in warns[start:start + self.page_size]:
+                reason = str(w.get("reason", ""))
+                embed.add_field(
+                    name=f"ID: {w['id']}",
+                    value=(f"Moderator: {self._moderator(w.get('moderator'))}\n"
+                           f"Reason: {reason if len(reason) <= 900 else reason[:900] + '…'}\n"
+                           f"Date: {w.get('date','')}"),
+                    inline=False
+                )
+        if THUMB_URL:
+            embed.set_thumbnail(url=THUMB_URL)
+        embed.set_footer(text=f"Page {self.page + 1}/{self.pages} • Requested by {self.invoker}")
+        return embed
+
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        if interaction.user.id != self.invoker.id:
+            await interaction.response.send_message("Only the command invoker can change pages.", ephemeral=True)
+            return False
+        return True
+
+    async def _show(self, interaction: discord.Interaction, delta: int):
+        self.page += delta
+        self._sync_buttons()
+        await interaction.response.edit_message(embed=self.build_embed(), view=self)
+
+    @discord.ui.button(label="Previous", style=discord.ButtonStyle.secondary, emoji="◀️")
+    async def prev_page(self, interaction: discord.Interaction, _):
+        await self._show(interaction, -1)
+
+    @discord.ui.button(label="Next", style=discord.ButtonStyle.secondary, emoji="▶️")
+    async def next_page(self, interaction: discord.Interaction, _):
+        await self._show(interaction, 1)
+
+    async def on_timeout(self):
+        for item in self.children:
+            item.disabled = True
+        try:
+            await self.message.edit(view=self)
+        except Exception:
+            pass
+
 @bot.command(name="warnings")
 async def warnings(ctx, user: discord.Member = None):
     if not user and ctx.message.reference:
         msg = await ctx.channel.fetch_message(ctx.message.reference.message_id)
         user = msg.author
     user = user or ctx.author
-    user_warns = warns_db.get(str(user.id), [])
-    embed = discord.Embed(title=f"Warnings for {user.display_name}", color=COLOR_BASE, timestamp=datetime.utcnow())
-    if not user_warns:
-        embed.description = "This user has no warnings."
+    view = WarningsView(ctx.author, user, ctx.guild)
+    if view.pages > 1:
+        view.message = await ctx.send(embed=view.build_embed(), view=view)
     else:
-        for w in user_warns:
-            mod = ctx.guild.get_member(int(w.get("moderator", 0))) if w.get("moderator") else None
-            embed.add_field(
-                name=f"ID: {w['id']}",
-                value=(f"Moderator: {mod.mention if mod else 'Unknown'}\n"
-                       f"Reason: {w.get('reason','')}\n"
-                       f"Date: {w.get('date','')}"),
-                inline=False
-            )
-    if THUMB_URL:
-        embed.set_thumbnail(url=THUMB_URL)
-    embed.set_footer(text=f"Requested by {ctx.author}")
-    await ctx.send(embed=embed)
+        await ctx.send(embed=view.build_embed())
 
 @bot.command(name="warnremove")
 @commands.has_permissions(kick_members=True, ban_members=True, manage_roles=True)
@@ -1122,16 +3553,17 @@ async def warnremove(ctx, warn_id: str = None):
         embed.set_footer(text=f"Requested by {ctx.author}")
         await ctx.send(f"{ctx.author.mention}", embed=embed)
         return
+    user_id = warn_index.pop(warn_id)
+    warn_list = warns_db.get(user_id, []) if user_id else []
     found = False
-    for user_id, warn_list in list(warns_db.items()):
-        for w in list(warn_list):
-            if w["id"] == warn_id:
-                warn_list.remove(w)
-                found = True
-                if not warn_list:
-                    del warns_db[user_id]
-                save_warns()
-                break
+    for i, w in enumerate(warn_list):
+        if str(w["id"]) == warn_id:
+            del warn_list[i]
+            found = True
+            if not warn_list:
+                del warns_db[user_id]
+            storage.remove_warn(warns_db, user_id, warn_id)
+            break
     if not found:
         embed = discord.Embed(title="Not found", description=f"No warning found with ID {warn_id}.", color=COLOR_ERR)
         if THUMB_URL:
@@ -1148,7 +3580,7 @@ async def warnremove(ctx, warn_id: str = None):
 @bot.group(name="antilink", invoke_without_command=True)
 @commands.has_permissions(administrator=True)
 async def antilink_group(ctx):
-    await ctx.send(f"Usage: {BOT_PREFIX}antilink on|off|status|whitelist add @user|whitelist remove @user|whitelist list")
+    await ctx.send(f"Usage: {BOT_PREFIX}antilink on|off|status|whitelist add @user|whitelist remove @user|whitelist list|allow add/remove/list <domain>|block add/remove/list <domain>")
 
 @antilink_group.command(name="on")
 @commands.has_permissions(administrator=True)
@@ -1173,6 +3605,9 @@ async def antilink_status(ctx):
     embed = discord.Embed(title="Antilink Status", color=COLOR_BASE, timestamp=datetime.utcnow())
     embed.add_field(name="Status", value=st, inline=False)
     embed.add_field(name="Whitelist", value=wl_txt, inline=False)
+    lists = antilink_cfg["domains"].get(str(ctx.guild.id), {})
+    embed.add_field(name="Allowed domains", value=str(len(lists.get("allow", []))), inline=True)
+    embed.add_field(name="Blocked domains", value=str(len(lists.get("block", []))), inline=True)
     if THUMB_URL:
         embed.set_thumbnail(url=THUMB_URL)
     await ctx.send(embed=embed)
@@ -1190,6 +3625,7 @@ async def antilink_whitelist_add(ctx, member: discord.Member = None):
     uid = str(member.id)
     if uid not in antilink_cfg["whitelist"]:
         antilink_cfg["whitelist"].append(uid)
+        link_filter.whitelist.add(member.id)
         save_antilink()
     await ctx.send(f"{member.mention} added to whitelist.")
 
@@ -1201,6 +3637,7 @@ async def antilink_whitelist_remove(ctx, member: discord.Member = None):
     uid = str(member.id)
     if uid in antilink_cfg["whitelist"]:
         antilink_cfg["whitelist"].remove(uid)
+        link_filter.whitelist.discard(member.id)
         save_antilink()
         return await ctx.send(f"{member.mention} removed from whitelist.")
     await ctx.send("That user is not in the whitelist.")
@@ -1214,78 +3651,334 @@ async def antilink_whitelist_list(ctx):
     txt = ", ".join([f"<@{int(uid)}>" for uid in wl])
     await ctx.send(f"Whitelist: {txt}")
 
-@bot.event
-async def on_message(message: discord.Message):
-    if not message.guild:
-        return
-    if message.author.bot:
-        return
-    if message.author.id in afk_users:
-        afk_users.pop(message.author.id, None)
+async def _antilink_domains(ctx, kind: str, action: str, domain: str):
+    lists = antilink_cfg["domains"].setdefault(str(ctx.guild.id), {"allow": [], "block": []})
+    entries = lists.setdefault(kind, [])
+    label = "allowlist" if kind == "allow" else "blocklist"
+    if action == "list":
+        if not entries:
+            return await ctx.send(f"The {label} is empty.")
+        txt = ", ".join(f"`{d}`" for d in sorted(entries))
+        return await ctx.send(f"Domain {label}: {txt[:1900]}")
+    domain = normalize_domain(domain or "")
+    if "." not in domain:
+        return await ctx.send(f"You must provide a domain. E.g.: {BOT_PREFIX}antilink {kind} {action} example.com")
+    other = lists.setdefault("block" if kind == "allow" else "allow", [])
+    if action == "add":
+        if domain in other:
+            other.remove(domain)
+        if domain not in entries:
+            entries.append(domain)
+        text = f"`{domain}` added to the {label}."
+    elif domain in entries:
+        entries.remove(domain)
+        text = f"`{domain}` removed from the {label}."
+    else:
+        return await ctx.send(f"`{domain}` is not in the {label}.")
+    link_filter.invalidate(ctx.guild.id)
+    save_antilink()
+    await ctx.send(text)
+
+@antilink_group.group(name="allow", invoke_without_command=True)
+@commands.has_permissions(administrator=True)
+async def antilink_allow(ctx):
+    await ctx.send(f"Usage: {BOT_PREFIX}antilink allow add <domain> | remove <domain> | list")
+
+@antilink_allow.command(name="add")
+@commands.has_permissions(administrator=True)
+async def antilink_allow_add(ctx, domain: str = None):
+    await _antilink_domains(ctx, "allow", "add", domain)
+
+@antilink_allow.command(name="remove")
+@commands.has_permissions(administrator=True)
+async def antilink_allow_remove(ctx, domain: str = None):
+    await _antilink_domains(ctx, "allow", "remove", domain)
+
+@antilink_allow.command(name="list")
+@commands.has_permissions(administrator=True)
+async def antilink_allow_list(ctx):
+    await _antilink_domains(ctx, "allow", "list", None)
+
+@antilink_group.group(name="block", invoke_without_command=True)
+@commands.has_permissions(administrator=True)
+async def antilink_block(ctx):
+    await ctx.send(f"Usage: {BOT_PREFIX}antilink block add <domain> | remove <domain> | list")
+
+@antilink_block.command(name="add")
+@commands.has_permissions(administrator=True)
+async def antilink_block_add(ctx, domain: str = None):
+    await _antilink_domains(ctx, "block", "add", domain)
+
+@antilink_block.command(name="remove")
+@commands.has_permissions(administrator=True)
+async def antilink_block_remove(ctx, domain: str = None):
+    await _antilink_domains(ctx, "block", "remove", domain)
+
+@antilink_block.command(name="list")
+@commands.has_permissions(administrator=True)
+async def antilink_block_list(ctx):
+    await _antilink_domains(ctx, "block", "list", None)
+
+class OutboundDispatcher:
+    def __init__(self):
+        self._tasks = set()
+        self.sent = 0
+        self.failed = 0
+
+    def dispatch(self, coro):
+        task = asyncio.get_running_loop().create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._done)
+        return task
+
+    def _done(self, task: asyncio.Task):
+        self._tasks.discard(task)
+        if task.cancelled() or task.exception() is not None:
+            self.failed += 1
+        else:
+            self.sent += 1
+
+    def summary(self) -> str:
+        return f"{self.sent} sent • {self.failed} failed • {len(self._tasks)} in flight"
+
+class MessagePipeline:
+    def __init__(self):
+        self.stages = []
+        self.timings = {}
+        self.errors = {}
+
+    def stage(self, name: str):
+        def register(func):
+            self.stages.append((name, func))
+            self.timings[name] = LatencyHistogram()
+            self.errors[name] = 0
+            return func
+        return register
+
+    async def run(self, message: discord.Message):
+        for name, func in self.stages:
+            started = time.perf_counter()
+            try:
+                stop = await func(message)
+            except Exception as e:
+                self.errors[name] += 1
+                print(f"on_message stage {name} failed: {e!r}")
+                stop = False
+            self.timings[name].observe((time.perf_counter() - started) * 1000)
+            if stop:
+                break
+
+    def summary(self) -> str:
+        return "\n".join(f"{name}: {self.timings[name].summary()} • {self.errors[name]} errors" for name, _ in self.stages)
+
+outbound = OutboundDispatcher()
+message_pipeline = MessagePipeline()
+
+class AfkStore:
+    def __init__(self, users: dict, max_age_hours: float):
+        self.users = users
+        self.max_age = timedelta(hours=max_age_hours) if max_age_hours > 0 else None
+        self._expiry = []
+        self._db = {}
+        self.expired = 0
+
+    def load(self):
+        self._db = storage.load_afk()
+        stale = []
+        now = datetime.utcnow()
+        for uid, entry in list(self._db.items()):
+            try:
+                since = datetime.fromisoformat(entry["since"])
+            except (KeyError, TypeError, ValueError):
+                stale.append(uid)
+                continue
+            if self.max_age and now - since >= self.max_age:
+                stale.append(uid)
+                continue
+            self.users[int(uid)] = {"reason": entry.get("reason") or "Unspecified", "since": since}
+            self._schedule(int(uid), since)
+        if stale:
+            for uid in stale:
+                self._db.pop(uid, None)
+            storage.clear_afk(self._db, stale)
+
+    def _schedule(self, uid: int, since: datetime):
+        if self.max_age:
+            heapq.heappush(self._expiry, (since + self.max_age, uid, since))
+
+    def set(self, uid: int, reason: str):
+        since = datetime.utcnow()
+        self.users[uid] = {"reason": reason, "since": since}
+        entry = {"reason": reason, "since": since.isoformat()}
+        self._db[str(uid)] = entry
+        storage.set_afk(self._db, str(uid), entry)
+        self._schedule(uid, since)
+
+    def pop(self, uid: int):
+        info = self.users.pop(uid, None)
+        if info is not None:
+            self._db.pop(str(uid), None)
+            storage.clear_afk(self._db, [str(uid)])
+        return info
+
+    def expire(self, now: Optional[datetime] = None):
+        if not self._expiry:
+            return 0
+        now = now or datetime.utcnow()
+        gone = []
+        while self._expiry and self._expiry[0][0] <= now:
+            _, uid, since = heapq.heappop(self._expiry)
+            info = self.users.get(uid)
+            if info is not None and info["since"] == since:
+                del self.users[uid]
+                self._db.pop(str(uid), None)
+                gone.append(str(uid))
+        if gone:
+            self.expired += len(gone)
+            storage.clear_afk(self._db, gone)
+        return len(gone)
+
+afk_store = AfkStore(afk_users, AFK_MAX_AGE_HOURS)
+afk_store.load()
+
+@message_pipeline.stage("afk_clear")
+async def _stage_afk_clear(message: discord.Message):
+    afk_store.expire()
+    if message.author.id not in afk_users:
+        return False
+    afk_store.pop(message.author.id)
+    embed = discord.Embed(
+        title="AFK cleared",
+        description=f"{message.author.mention}, your AFK status has been removed.",
+        color=COLOR_OK,
+        timestamp=datetime.utcnow()
+    )
+    if THUMB_URL:
+        embed.set_thumbnail(url=THUMB_URL)
+    embed.set_footer(text="AFK")
+    outbound.dispatch(message.channel.send(embed=embed, delete_after=10))
+    return False
+
+def _afk_duration(since: datetime) -> str:
+    total_seconds = int((datetime.utcnow() - since).total_seconds())
+    hours = total_seconds // 3600
+    minutes = (total_seconds % 3600) // 60
+    seconds = total_seconds % 60
+    time_str = []
+    if hours > 0:
+        time_str.append(f"{hours}h")
+    if minutes > 0:
+        time_str.append(f"{minutes}m")
+    time_str.append(f"{seconds}s")
+    return " ".join(time_str)
+
+class AfkNoticeLimiter:
+    def __init__(self, cooldown: float):
+        self.cooldown = cooldown
+        self.last_sent = {}
+        self.suppressed = 0
+        self._next_prune = 0.0
+
+    def allow(self, channel_id: int, user_id: int, now: float) -> bool:
+        key = (channel_id, user_id)
+        last = self.last_sent.get(key)
+        if last is not None and now - last < self.cooldown:
+            self.suppressed += 1
+            return False
+        self.last_sent[key] = now
+        return True
+
+    def prune(self, now: float):
+        if now < self._next_prune:
+            return
+        self._next_prune = now + max(self.cooldown, 1.0)
+        for key, last in list(self.last_sent.items()):
+            if now - last >= self.cooldown:
+                del self.last_sent[key]
+
+afk_notices = AfkNoticeLimiter(AFK_NOTICE_COOLDOWN)
+
+@message_pipeline.stage("afk_mentions")
+async def _stage_afk_mentions(message: discord.Message):
+    if not afk_users or not message.mentions:
+        return False
+    now = time.monotonic()
+    afk_notices.prune(now)
+    pending = []
+    for user in message.mentions:
+        if user.id in afk_users and afk_notices.allow(message.channel.id, user.id, now):
+            pending.append((user, afk_users[user.id]))
+    if not pending:
+        return False
+    if len(pending) == 1:
+        user, info = pending[0]
         embed = discord.Embed(
-            title="AFK cleared",
-            description=f"{message.author.mention}, your AFK status has been removed.",
-            color=COLOR_OK,
+            title=f"{user.display_name} is AFK",
+            description=f"Reason: {info['reason']}\nAFK time: {_afk_duration(info['since'])}",
+            color=0xffa500,
             timestamp=datetime.utcnow()
         )
-        if THUMB_URL:
-            embed.set_thumbnail(url=THUMB_URL)
-        embed.set_footer(text="AFK")
-        await message.channel.send(embed=embed, delete_after=10)
-    for user in message.mentions:
-        if user.id in afk_users:
-            info = afk_users[user.id]
-            delta = datetime.utcnow() - info["since"]
-            total_seconds = int(delta.total_seconds())
-            hours = total_seconds // 3600
-            minutes = (total_seconds % 3600) // 60
-            seconds = total_seconds % 60
-            time_str = []
-            if hours > 0:
-                time_str.append(f"{hours}h")
-            if minutes > 0:
-                time_str.append(f"{minutes}m")
-            time_str.append(f"{seconds}s")
-            time_str = " ".join(time_str)
-            embed = discord.Embed(
-                title=f"{user.display_name} is AFK",
-                description=f"Reason: {info['reason']}\nAFK time: {time_str}",
-                color=0xffa500,
-                timestamp=datetime.utcnow()
-            )
-            if THUMB_URL:
-                embed.set_thumbnail(url=THUMB_URL)
-            embed.set_footer(text="AFK")
-            await message.channel.send(f"{message.author.mention}", embed=embed, delete_after=20)
-    if antilink_cfg.get("enabled") and not antilink_allowed(message.author):
-        if antiregex.search(message.content or ""):
-            try:
-                await message.delete()
-            except discord.Forbidden:
-                pass
-            await message.channel.send(f"{message.author.mention} Links are not allowed here.", delete_after=6)
-            return
+    else:
+        embed = discord.Embed(title=f"{len(pending)} mentioned users are AFK", color=0xffa500, timestamp=datetime.utcnow())
+        for user, info in pending[:25]:
+            embed.add_field(name=user.display_name, value=f"Reason: {info['reason']}\nAFK time: {_afk_duration(info['since'])}"[:200], inline=False)
+        if len(pending) > 25:
+            embed.description = f"Showing 25 of {len(pending)}."
+    if THUMB_URL:
+        embed.set_thumbnail(url=THUMB_URL)
+    embed.set_footer(text="AFK")
+    outbound.dispatch(message.channel.send(f"{message.author.mention}", embed=embed, delete_after=20))
+    return False
+
+async def _delete_quietly(message: discord.Message):
     try:
-        leveled, new_level, cur_prog, next_req, total_msgs = add_message_and_check_levelup(message.author.id)
-        if leveled > 0:
-            e = discord.Embed(
-                title="Level Up",
-                description=f"{message.author.mention} is now Level {new_level}",
-                color=COLOR_OK,
-                timestamp=datetime.utcnow()
-            )
-            e.add_field(name="Total messages", value=str(total_msgs), inline=True)
-            e.add_field(name="Next level in", value=f"{next_req - cur_prog} messages", inline=True)
-            if THUMB_URL:
-                e.set_thumbnail(url=THUMB_URL)
-            await message.channel.send(embed=e)
-    except Exception:
+        await message.delete()
+    except (discord.Forbidden, discord.NotFound):
         pass
+
+@message_pipeline.stage("antilink")
+async def _stage_antilink(message: discord.Message):
+    if not antilink_cfg.get("enabled") or not link_filter.check(message.guild.id, message.content or ""):
+        return False
+    if antilink_allowed(message.author):
+        return False
+    outbound.dispatch(_delete_quietly(message))
+    outbound.dispatch(message.channel.send(f"{message.author.mention} Links are not allowed here.", delete_after=6))
+    return True
+
+@message_pipeline.stage("leveling")
+async def _stage_leveling(message: discord.Message):
+    leveled, new_level, cur_prog, next_req, total_msgs = add_message_and_check_levelup(message.guild.id, message.author.id)
+    if leveled > 0:
+        e = discord.Embed(
+            title="Level Up",
+            description=f"{message.author.mention} is now Level {new_level}",
+            color=COLOR_OK,
+            timestamp=datetime.utcnow()
+        )
+        e.add_field(name="Total messages", value=str(total_msgs), inline=True)
+        e.add_field(name="Next level in", value=f"{next_req - cur_prog} messages", inline=True)
+        if THUMB_URL:
+            e.set_thumbnail(url=THUMB_URL)
+        outbound.dispatch(message.channel.send(embed=e))
+    return False
+
+@message_pipeline.stage("commands")
+async def _stage_commands(message: discord.Message):
     await bot.process_commands(message)
+    return False
+
+@bot.event
+async def on_message(message: discord.Message):
+    if not message.guild:
+        return
+    if message.author.bot:
+        return
+    await message_pipeline.run(message)
 
 @bot.command(name="afk")
 async def afk(ctx, *, reason: str = "Unspecified"):
-    afk_users[ctx.author.id] = {"reason": reason, "since": datetime.utcnow()}
+    afk_store.set(ctx.author.id, reason)
     embed = discord.Embed(title="AFK enabled", description=f"{ctx.author.mention} is now AFK.\nReason: {reason}", color=0xffa500, timestamp=datetime.utcnow())
     if THUMB_URL:
         embed.set_thumbnail(url=THUMB_URL)
@@ -1381,6 +4074,15 @@ async def botinfo(ctx):
     embed.add_field(name="Uptime", value=pretty, inline=True)
     embed.add_field(name="Process Memory", value=mem_txt, inline=True)
     embed.add_field(name="Prefix", value=f"`{BOT_PREFIX}`", inline=True)
+    embed.add_field(name="Levels flush", value=levels_writer.summary(), inline=False)
+    embed.add_field(name="Permission cache", value=perm_cache.summary(), inline=False)
+    embed.add_field(name="Ticket routing", value=ticket_routes.summary(), inline=False)
+    embed.add_field(name="Interactions", value=interaction_router.summary()[:1024], inline=False)
+    embed.add_field(name="Ban index", value=ban_index.summary(), inline=False)
+    embed.add_field(name="Polls", value=poll_engine.summary(), inline=False)
+    embed.add_field(name="Giveaways", value=f"{gw_scheduler.summary()}\n{gw_records.summary()}", inline=False)
+    embed.add_field(name="Message pipeline", value=message_pipeline.summary()[:1024], inline=False)
+    embed.add_field(name="Outbound sends", value=outbound.summary(), inline=False)
     if THUMB_URL:
         embed.set_thumbnail(url=THUMB_URL)
     embed.set_footer(text=f"Requested by {ctx.author}")
@@ -1436,7 +4138,7 @@ async def banner(ctx, member: discord.Member = None):
 
 @bot.command(name="gwstart")
 async def gwstart(ctx, duration: str = None, *, rest: str = None):
-    mod_ok = ctx.author.guild_permissions.manage_messages or ctx.author.guild_permissions.administrator
+    mod_ok = perm_cache.is_mod(ctx.author)
     if not mod_ok:
         return await ctx.send(f"{ctx.author.mention}, you don't have permission to use this command.", delete_after=10)
     usage = f"Usage: {BOT_PREFIX}gwstart <duration> <prize> [winners]\nExamples:\n{BOT_PREFIX}gwstart 1h Key\n{BOT_PREFIX}gwstart 2d3h VIP 3"
@@ -1455,25 +4157,21 @@ async def gwstart(ctx, duration: str = None, *, rest: str = None):
         seconds = parse_duration(duration)
     except ValueError:
         return await ctx.send("Invalid duration. Use d, h, m. E.g.: 1d2h30m.\n" + usage)
-    end_at = datetime.utcnow().timestamp() + seconds
-    ends_text = fmt_delta(seconds)
-    embed = discord.Embed(
-        title=f"Giveaway running — {winners_label(winners)}",
-        description=build_gw_description(prize, ends_text, 0, winners),
-        color=COLOR_BASE, timestamp=datetime.utcnow()
-    )
-    if THUMB_URL:
-        embed.set_thumbnail(url=THUMB_URL)
-    msg = await ctx.send(embed=embed, view=GiveawayView(0))
-    giveaways[msg.id] = {
-        "end": end_at, "prize": prize, "winners": winners,
-        "participants": set(), "channel_id": ctx.channel.id,
+    started = datetime.utcnow().timestamp()
+    data = {
+        "end": started + seconds, "prize": prize, "winners": winners,
+        "participants": set(), "channel_id": ctx.channel.id, "started": started,
     }
+    embed = build_gw_embed(data, seconds)
+    msg = await ctx.send(embed=embed, view=GiveawayView(0))
+    giveaways[msg.id] = data
+    storage.save_giveaway(giveaways, msg.id)
+    gw_scheduler.add(msg.id, embed.description)
     await msg.edit(view=GiveawayView(msg.id))
 
 @bot.command(name="gwend")
 async def gwend(ctx):
-    mod_ok = ctx.author.guild_permissions.manage_messages or ctx.author.guild_permissions.administrator
+    mod_ok = perm_cache.is_mod(ctx.author)
     if not mod_ok:
         return await ctx.send(f"{ctx.author.mention}, you don't have permission to use this command.", delete_after=10)
     usage = f"Usage: reply to the giveaway message with {BOT_PREFIX}gwend"
@@ -1490,7 +4188,7 @@ async def gwend(ctx):
 
 @bot.command(name="gwreroll")
 async def gwreroll(ctx):
-    mod_ok = ctx.author.guild_permissions.manage_messages or ctx.author.guild_permissions.administrator
+    mod_ok = perm_cache.is_mod(ctx.author)
     if not mod_ok:
         return await ctx.send(f"{ctx.author.mention}, you don't have permission to use this command.", delete_after=10)
     usage = f"Usage: reply to the ended giveaway message with {BOT_PREFIX}gwreroll"
@@ -1503,60 +4201,202 @@ async def gwreroll(ctx):
     rec = gw_records.get(ref_msg.id)
     if not rec:
         return await ctx.send("I can't find data for that giveaway.", delete_after=10)
-    participants = [uid for uid in rec.get("participants", []) if isinstance(uid, int) or str(uid).isdigit()]
-    won = set([uid for uid in rec.get("won", []) if isinstance(uid, int) or str(uid).isdigit()])
-    pool = [uid for uid in participants if int(uid) not in won]
-    if not pool:
+    drawn = rec["pool"].draw(1)
+    if not drawn:
         return await ctx.send("No participants available for reroll.", delete_after=10)
-    new_winner = random.choice(pool)
-    won.add(int(new_winner))
-    rec["won"] = list(won)
-    gw_records[ref_msg.id] = rec
+    new_winner = drawn[0]
+    rec["won"].append(new_winner)
+    gw_records.save(ref_msg.id)
     mention = f"<@{int(new_winner)}>"
     prize = rec.get("prize", "Prize")
     await ctx.send(f"Reroll for giveaway {ref_msg.jump_url}\nNew winner: {mention}\nPrize: {prize}")
 
 class PollView(discord.ui.View):
-    def __init__(self, options):
-        super().__init__(timeout=300)
-        self.votes = {opt: set() for opt in options}
-        for opt in options[:5]:
-            self.add_item(discord.ui.Button(label=opt, style=discord.ButtonStyle.primary, custom_id=opt))
-    @discord.ui.button(label="End", style=discord.ButtonStyle.danger, custom_id="__end", row=1)
-    async def end(self, interaction: discord.Interaction, _):
-        results = "\n".join(f"• {k} — {len(v)} vote(s)" for k, v in self.votes.items())
-        await interaction.response.edit_message(content=f"Results:\n{results}", view=None, embed=None)
-    async def interaction_check(self, interaction: discord.Interaction) -> bool:
-        cid = interaction.data.get("custom_id")
-        if cid and cid in self.votes:
-            for s in self.votes.values():
-                s.discard(interaction.user.id)
-            self.votes[cid].add(interaction.user.id)
-            await interaction.response.send_message(f"You voted for {cid}", ephemeral=True)
-        return False
+    def __init__(self, poll_id: int, options):
+        super().__init__(timeout=None)
+        self.poll_id = poll_id
+        self.add_item(discord.ui.Select(
+            custom_id=f"poll:{poll_id}:vote",
+            placeholder="Choose an option",
+            options=[discord.SelectOption(label=opt[:100], value=str(i)) for i, opt in enumerate(options[:25])]
+        ))
+        self.add_item(discord.ui.Button(label="End", style=discord.ButtonStyle.danger, custom_id=f"poll:{poll_id}:end", row=1))
+
+class PollEngine:
+    def __init__(self, debounce: float):
+        self.debounce = debounce
+        self.polls = {}
+        self._last_edit = {}
+        self._pending = {}
+        self._timers = {}
+        self.votes = 0
+        self.edits = 0
+
+    def _count(self, poll: dict):
+        poll["counts"] = [0] * len(poll["options"])
+        for idx in poll["votes"].values():
+            if 0 <= idx < len(poll["counts"]):
+                poll["counts"][idx] += 1
+
+    def restore(self):
+        self.polls.update(storage.load_polls())
+        for poll_id, poll in self.polls.items():
+            self._count(poll)
+            if poll.get("end"):
+                self._schedule_end(poll_id)
+        return len(self.polls)
+
+    def create(self, poll_id: int, message: discord.Message, author_id: int, question: str, options, end: Optional[float]):
+        poll = {"message_id": message.id, "channel_id": message.channel.id, "author_id": author_id,
+                "question": question, "options": list(options), "end": end, "votes": {}}
+        self._count(poll)
+        self.polls[poll_id] = poll
+        storage.save_poll(self.polls, poll_id)
+        if end:
+            self._schedule_end(poll_id)
+        return poll
+
+    def vote(self, poll_id: int, uid: int, idx: int) -> Optional[bool]:
+        poll = self.polls.get(poll_id)
+        if poll is None or not 0 <= idx < len(poll["options"]):
+            return None
+        previous = poll["votes"].get(uid)
+        if previous == idx:
+            return False
+        if previous is not None:
+            poll["counts"][previous] -= 1
+        poll["counts"][idx] += 1
+        poll["votes"][uid] = idx
+        storage.log_poll_vote(poll_id, uid, idx)
+        self.votes += 1
+        if poll_id not in self._pending:
+            self._pending[poll_id] = asyncio.get_running_loop().create_task(self._edit_later(poll_id))
+        return True
+
+    def render(self, poll: dict, ended: bool = False) -> discord.Embed:
+        total = sum(poll["counts"])
+        lines = []
+        for opt, count in zip(poll["options"], poll["counts"]):
+            share = count / total if total else 0.0
+            lines.append(f"**{opt}**\n`{progress_bar(count, total or 1, 12)}` {count} ({share * 100:.0f}%)")
+        if ended:
+            lines.append("\nPoll ended.")
+        elif poll.get("end"):
+            lines.append(f"\nEnds <t:{int(poll['end'])}:R>")
+        embed = discord.Embed(title=poll["question"], description="\n".join(lines)[:4096], color=COLOR_BASE, timestamp=datetime.utcnow())
+        if THUMB_URL:
+            embed.set_thumbnail(url=THUMB_URL)
+        embed.set_footer(text=f"{total} vote(s)")
+        return embed
+
+    def _message(self, poll: dict):
+        channel = bot.get_channel(poll["channel_id"])
+        return channel.get_partial_message(poll["message_id"]) if channel else None
+
+    async def _edit_later(self, poll_id: int):
+        try:
+            delay = self._last_edit.get(poll_id, 0.0) + self.debounce - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        finally:
+            self._pending.pop(poll_id, None)
+        poll = self.polls.get(poll_id)
+        msg = self._message(poll) if poll else None
+        if msg is None:
+            return
+        self._last_edit[poll_id] = time.monotonic()
+        try:
+            await msg.edit(embed=self.render(poll))
+            self.edits += 1
+        except discord.HTTPException as e:
+            print(f"poll {poll_id} update failed: {e!r}")
+
+    def _schedule_end(self, poll_id: int):
+        if poll_id not in self._timers:
+            self._timers[poll_id] = asyncio.get_running_loop().create_task(self._end_at(poll_id))
+
+    async def _end_at(self, poll_id: int):
+        await bot.wait_until_ready()
+        poll = self.polls.get(poll_id)
+        if poll is None:
+            return
+        await asyncio.sleep(max(0.0, poll["end"] - datetime.utcnow().timestamp()))
+        self._timers.pop(poll_id, None)
+        poll = self.finish(poll_id)
+        msg = self._message(poll) if poll else None
+        if msg is not None:
+            try:
+                await msg.edit(embed=self.render(poll, ended=True), view=None)
+            except discord.HTTPException as e:
+                print(f"poll {poll_id} end failed: {e!r}")
+
+    def finish(self, poll_id: int):
+        poll = self.polls.pop(poll_id, None)
+        if poll is None:
+            return None
+        for tasks in (self._pending, self._timers):
+            task = tasks.pop(poll_id, None)
+            if task and task is not asyncio.current_task():
+                task.cancel()
+        self._last_edit.pop(poll_id, None)
+        storage.remove_poll(self.polls, poll_id)
+        return poll
+
+    def summary(self) -> str:
+        return f"{len(self.polls)} open • {self.votes} votes • {self.edits} edits"
+
+poll_engine = PollEngine(POLL_EDIT_DEBOUNCE)
+
+@interaction_router.route("poll")
+async def _route_poll(interaction: discord.Interaction, arg: str):
+    poll_id, _, action = arg.partition(":")
+    poll = poll_engine.polls.get(int(poll_id)) if poll_id.isdigit() else None
+    if poll is None:
+        return await interaction.response.send_message("This poll is no longer active.", ephemeral=True)
+    if action == "end":
+        if interaction.user.id != poll.get("author_id") and not perm_cache.is_mod(interaction.user):
+            return await interaction.response.send_message("Only the poll author or moderation can end this poll.", ephemeral=True)
+        poll_engine.finish(int(poll_id))
+        return await interaction.response.edit_message(embed=poll_engine.render(poll, ended=True), view=None)
+    if action == "vote":
+        values = interaction.data.get("values") or []
+        action = values[0] if values else ""
+    if not action.isdigit():
+        return await interaction.response.send_message("That option doesn't exist.", ephemeral=True)
+    idx = int(action)
+    changed = poll_engine.vote(int(poll_id), interaction.user.id, idx)
+    if changed is None:
+        return await interaction.response.send_message("That option doesn't exist.", ephemeral=True)
+    choice = poll["options"][idx]
+    text = f"You voted for {choice}" if changed else f"You already voted for {choice}"
+    await interaction.response.send_message(text, ephemeral=True)
 
 @bot.command(name="poll")
 async def poll(ctx, *, data: str = None):
-    mod_ok = ctx.author.guild_permissions.manage_messages or ctx.author.guild_permissions.administrator
+    mod_ok = perm_cache.is_mod(ctx.author)
     if not mod_ok:
         return await ctx.send(f"{ctx.author.mention}, you don't have permission to use this command.", delete_after=10)
+    usage = f'Usage: {BOT_PREFIX}poll [duration] "Question" option1 | option2 | option3\nExample: {BOT_PREFIX}poll 2h "Best map?" Dust | Mirage | Inferno'
     if not data or '"' not in data:
-        return await ctx.send(f'Usage: {BOT_PREFIX}poll "Question" option1 | option2 | option3')
+        return await ctx.send(usage)
     try:
-        q = data.split('"', 2)[1]
-        opts_raw = data.split('"', 2)[2].strip()
-        options = [o.strip() for o in opts_raw.split("|") if o.strip()]
+        head, q, opts_raw = data.split('"', 2)
+        options = [o.strip() for o in opts_raw.strip().split("|") if o.strip()]
     except Exception:
-        return await ctx.send(f'Usage: {BOT_PREFIX}poll "Question" option1 | option2 | option3')
+        return await ctx.send(usage)
+    end = None
+    if head.strip():
+        try:
+            end = datetime.utcnow().timestamp() + parse_duration(head.strip())
+        except ValueError:
+            return await ctx.send("Invalid duration. Use d, h, m. E.g.: 1d2h30m.\n" + usage)
     if len(options) < 2:
         return await ctx.send("You must provide at least 2 options.")
-    if len(options) > 5:
-        options = options[:5]
-    view = PollView(options)
-    embed = discord.Embed(title=f"{q}", description="\n".join(f"• {o}" for o in options), color=COLOR_BASE, timestamp=datetime.utcnow())
-    if THUMB_URL:
-        embed.set_thumbnail(url=THUMB_URL)
-    await ctx.send(embed=embed, view=view)
+    if len(options) > 25:
+        options = options[:25]
+    preview = {"question": q, "options": options, "counts": [0] * len(options), "end": end}
+    msg = await ctx.send(embed=poll_engine.render(preview), view=PollView(ctx.message.id, options))
+    poll_engine.create(ctx.message.id, msg, ctx.author.id, q, options, end)
 
 @bot.command(name="servericon")
 async def servericon(ctx):
@@ -1790,8 +4630,72 @@ async def embedbuilder_error(ctx, error):
         embed.set_footer(text=f"Requested by {ctx.author}")
         await ctx.send(embed=embed, delete_after=10)
 
+@bot.event
+async def on_member_update(before: discord.Member, after: discord.Member):
+    if before.roles != after.roles:
+        perm_cache.forget_member(after.guild.id, after.id)
+
+@bot.event
+async def on_member_remove(member: discord.Member):
+    perm_cache.forget_member(member.guild.id, member.id)
+    part = level_partitions.resident(member.guild.id)
+    if part is not None:
+        part.leaderboard.discard(member.id)
+
+@bot.event
+async def on_guild_join(guild: discord.Guild):
+    if guild.me.guild_permissions.ban_members:
+        ban_index.warm(guild)
+
+@bot.event
+async def on_member_ban(guild: discord.Guild, user):
+    ban_index.added(guild.id, user)
+
+@bot.event
+async def on_member_unban(guild: discord.Guild, user):
+    ban_index.removed(guild.id, user.id)
+
+@bot.event
+async def on_guild_role_create(role: discord.Role):
+    ticket_routes.invalidate(role.guild.id)
+
+@bot.event
+async def on_guild_role_update(before: discord.Role, after: discord.Role):
+    if before.permissions != after.permissions:
+        perm_cache.forget_guild(after.guild.id)
+        ticket_routes.invalidate(after.guild.id)
+    elif before.position != after.position:
+        ticket_routes.invalidate(after.guild.id)
+
+@bot.event
+async def on_guild_role_delete(role: discord.Role):
+    perm_cache.forget_guild(role.guild.id)
+    ticket_routes.invalidate(role.guild.id)
+
+@bot.event
+async def on_guild_channel_create(channel):
+    if isinstance(channel, discord.CategoryChannel):
+        ticket_routes.invalidate(channel.guild.id)
+
+@bot.event
+async def on_guild_channel_update(before, after):
+    perm_cache.forget_guild(after.guild.id)
+    if isinstance(after, discord.CategoryChannel):
+        ticket_routes.invalidate(after.guild.id)
+
+@bot.event
+async def on_guild_channel_delete(channel):
+    if isinstance(channel, discord.CategoryChannel):
+        ticket_routes.invalidate(channel.guild.id)
+    elif ticket_store.get(channel.id):
+        ticket_store.close(channel.id)
+
 @bot.event
 async def on_member_join(member):
+    part = level_partitions.resident(member.guild.id)
+    slot = part.users.find(member.id) if part is not None and not member.bot else None
+    if slot is not None:
+        part.leaderboard.update(member.id, part.users.msgs[slot])
     channel = member.guild.system_channel
     if not channel:
         for c in member.guild.text_channels:
@@ -1810,47 +4714,19 @@ async def on_member_join(member):
         embed.set_thumbnail(url=THUMB_URL)
     await channel.send(content=f"Welcome {member.mention}", embed=embed)
 
-async def _gw_updater():
-    await bot.wait_until_ready()
-    while not bot.is_closed():
-        now_ts = datetime.utcnow().timestamp()
-        to_end = []
-        for mid, data in list(giveaways.items()):
-            remaining = int(data["end"] - now_ts)
-            if remaining <= 0:
-                to_end.append(mid)
-                continue
-            try:
-                channel = bot.get_channel(data["channel_id"])
-                if not channel:
-                    continue
-                msg = await channel.fetch_message(mid)
-                if not msg or not msg.embeds:
-                    continue
-                embed = msg.embeds[0]
-                embed.title = f"Giveaway running — {winners_label(data['winners'])}"
-                embed.description = build_gw_description(data["prize"], fmt_delta(remaining), len(data["participants"]), data["winners"])
-                await msg.edit(embed=embed, view=GiveawayView(mid))
-            except Exception:
-                pass
-        for mid in to_end:
-            try:
-                await end_giveaway(bot, mid)
-            except Exception:
-                pass
-        await asyncio.sleep(30)
-
 @bot.command(name="rank")
 async def rank_cmd(ctx, member: discord.Member = None):
     member = member or ctx.author
     if member.bot:
         return await ctx.send("Bots don't have levels.")
-    stats = get_user_stats(member.id)
+    part = level_partitions.get(ctx.guild.id)
+    stats = part.stats(member.id)
     cur_level = stats["level"]
     total_msgs = stats["msgs"]
     needed_next = msgs_needed_for_next(cur_level)
     cur_prog = total_msgs - cumulative_msgs_for_level(cur_level)
     bar = progress_bar(cur_prog, needed_next, 20)
+    position = part.leaderboard.rank(member.id)
     embed = discord.Embed(
         title=f"Level of {member.display_name}",
         color=COLOR_BASE,
@@ -1862,33 +4738,31 @@ async def rank_cmd(ctx, member: discord.Member = None):
         embed.set_thumbnail(url=THUMB_URL)
     embed.add_field(name="Level", value=f"{cur_level}", inline=True)
     embed.add_field(name="Total messages", value=f"{total_msgs}", inline=True)
+    embed.add_field(name="Position", value=f"#{position} of {len(part.leaderboard)}" if position else "Unranked", inline=True)
     embed.add_field(name="Progress", value=f"{bar}\n{cur_prog}/{needed_next}", inline=False)
     await ctx.send(embed=embed)
 
 @bot.command(name="top")
 async def top_cmd(ctx, n: int = 10):
     n = max(1, min(25, n))
-    pairs = []
-    for uid_str, data in levels_db.get("users", {}).items():
-        try:
-            uid = int(uid_str)
-        except:
-            continue
+    part = level_partitions.get(ctx.guild.id)
+    top_list = []
+    for uid, total_msgs in part.leaderboard.iter_from(0):
         member = ctx.guild.get_member(uid)
-        if member and not member.bot:
-            lvl = int(data.get("level", 0))
-            total_msgs = int(data.get("msgs", 0))
-            cur_prog = total_msgs - cumulative_msgs_for_level(lvl)
-            req = msgs_needed_for_next(lvl)
-            score = lvl + (cur_prog / req if req > 0 else 0)
-            pairs.append((member, lvl, total_msgs, cur_prog, req, score))
-    pairs.sort(key=lambda x: x[5], reverse=True)
-    top_list = pairs[:n]
+        if not member or member.bot:
+            continue
+        row = part.users.get(uid)
+        lvl = row["level"] if row else 0
+        cur_prog = total_msgs - cumulative_msgs_for_level(lvl)
+        req = msgs_needed_for_next(lvl)
+        top_list.append((member, lvl, total_msgs, cur_prog, req))
+        if len(top_list) >= n:
+            break
     if not top_list:
         return await ctx.send("No level data yet.")
     lines = []
     pos = 1
-    for m, lvl, total_msgs, cur_prog, req, score in top_list:
+    for m, lvl, total_msgs, cur_prog, req in top_list:
         lines.append(f"#{pos} — {m.mention} • Level {lvl} — {cur_prog}/{req} (Total {total_msgs})")
         pos += 1
     embed = discord.Embed(
@@ -1908,7 +4782,7 @@ async def levelset_cmd(ctx, member: discord.Member = None, level: int = None):
         return await ctx.send(f"Usage: {BOT_PREFIX}levelset @user <level>")
     if member.bot:
         return await ctx.send("You can't set levels for bots.")
-    set_level(member.id, int(level))
+    set_level(ctx.guild.id, member.id, int(level))
     embed = discord.Embed(
         title="Level updated",
         description=f"{member.mention} is now Level {int(level)}",
@@ -1925,7 +4799,7 @@ async def levelset_cmd(ctx, member: discord.Member = None, level: int = None):
 async def levelreset_cmd(ctx):
     embed = discord.Embed(
         title="Confirm level reset",
-        description="This will set to 0 the level and messages of all users stored by the bot. Irreversible action.",
+        description="This will set to 0 the level and messages of all users in this server. Irreversible action.",
         color=COLOR_WARN,
         timestamp=datetime.utcnow()
     )
@@ -1939,10 +4813,10 @@ async def levelreset_cmd(ctx):
         async def confirm(self, interaction: discord.Interaction, _):
             if interaction.user != self.author:
                 return await interaction.response.send_message("Only the command invoker can confirm.", ephemeral=True)
-            set_all_zero()
+            set_all_zero(interaction.guild.id)
             ok = discord.Embed(
                 title="Reset completed",
-                description="All levels and messages have been reset to 0.",
+                description="All levels and messages in this server have been reset to 0.",
                 color=COLOR_OK,
                 timestamp=datetime.utcnow()
             )
@@ -1956,11 +4830,33 @@ async def levelreset_cmd(ctx):
             await interaction.response.edit_message(content="Operation canceled.", embed=None, view=None)
     await ctx.send(embed=embed, view=ConfirmResetView(ctx.author))
 
+@bot.event
+async def setup_hook():
+    if LEVELS_WRITE_MODE != "sync":
+        levels_writer.start()
+    restore_giveaways()
+    gw_scheduler.start()
+    poll_engine.restore()
+    ticket_store.load()
+    bot.add_view(TicketManageView())
+
 @bot.event
 async def on_ready():
     print(f"bot is online")
+    await migrate_legacy_levels(bot.guilds)
+    for guild in bot.guilds:
+        if guild.me.guild_permissions.ban_members:
+            ban_index.warm(guild)
+    for guild in bot.guilds:
+        part = level_partitions.resident(guild.id)
+        if part is not None:
+            part.rebuild_leaderboard()
+    ticket_store.reconcile()
     await bot.change_presence(status=discord.Status.dnd, activity=discord.Game(name=f"{BOT_PREFIX}help"))
-    bot.loop.create_task(_gw_updater())
 
 if __name__ == "__main__":
-    bot.run(BOT_TOKEN)
+    try:
+        bot.run(BOT_TOKEN)
+    finally:
+        levels_writer.flush_sync()
+        storage.close()